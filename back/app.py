@@ -1,54 +1,191 @@
 import os
+import threading
 from flask import Flask, jsonify
 from dotenv import load_dotenv
 from flask_jwt_extended import JWTManager
-from extensions import mongo 
+from extensions import mongo
+from catalog import catalog
 from flask_mail import Mail
 from flask_cors import CORS
 
 # Cargar variables de entorno (.env ubicado en la raíz del proyecto)
 load_dotenv(os.path.join(os.path.dirname(__file__),"..", '.env'))
 
-app = Flask(__name__)
-app.config["MONGO_URI"] = os.getenv("MONGO_URI")
-app.config["JWT_SECRET_KEY"] = os.getenv("SECRET_KEY")
-CORS(app)
 
-# Configuración de correo (ajusta según tu servidor SMTP)
-app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
-app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 587))
-app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() in ["true", "1", "yes"]
-app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
-app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER")
+def load_config(app):
+    app.config["MONGO_URI"] = os.getenv("MONGO_URI")
+    app.config["JWT_SECRET_KEY"] = os.getenv("SECRET_KEY")
 
-# Inicializamos las extensiones con la app
-mongo.init_app(app)
-jwt = JWTManager(app)
-mail = Mail(app)
+    # Pool de conexiones a MongoDB (por proceso worker)
+    app.config["MONGO_MAX_POOL_SIZE"] = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+    app.config["MONGO_MIN_POOL_SIZE"] = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+    app.config["MONGO_MAX_IDLE_TIME_MS"] = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000))
+    app.config["MONGO_CONNECT_TIMEOUT_MS"] = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"] = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+    app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"] = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+    # /health/ready responde 503 si la fracción del pool en uso llega a este valor
+    app.config["READY_MAX_POOL_SATURATION"] = float(os.getenv("READY_MAX_POOL_SATURATION", 1.0))
 
-# Registrar el blueprint de endpoints de usuarios
-from endpoints.epUsers import users_bp
-app.register_blueprint(users_bp)
+    # Configuración de correo (ajusta según tu servidor SMTP)
+    app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
+    app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 587))
+    app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() in ["true", "1", "yes"]
+    app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
+    app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER")
+    # Hilos que envían los correos encolados (0 para no enviar desde la API, p.ej. usando `flask outbox-drain`)
+    app.config["MAIL_OUTBOX_WORKERS"] = int(os.getenv("MAIL_OUTBOX_WORKERS", 1))
+    app.config["MAIL_OUTBOX_BATCH"] = int(os.getenv("MAIL_OUTBOX_BATCH", 20))
 
-# Registrar el blueprint de endpoints de las unidades
-from endpoints.epUnits import units_bp
-app.register_blueprint(units_bp)
+    # Hasheo de contraseñas (ver passwords.py)
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+    app.config["PASSWORD_HASH_MAX_QUEUE"] = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", app.config["PASSWORD_HASH_WORKERS"] * 8))
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
 
-# Registrar el blueprint de endpoints de las preguntas
-from endpoints.epQuestions import questions_bp
-app.register_blueprint(questions_bp)
+    # Cohorte (curso y cuatrimestre) de los requests sin X-Cohort ni ?cohort= (ver cohorts.py)
+    app.config["CURRENT_COHORT"] = os.getenv("CURRENT_COHORT", "")
 
-# Registrar el blueprint de endpoints de las respuestas
-from endpoints.epAnswers import answers_bp
-app.register_blueprint(answers_bp)
+    # Sólo se guarda la primera respuesta correcta de cada usuario a cada pregunta (ver indexes.py)
+    app.config["ANSWERS_FIRST_CORRECT_WINS"] = os.getenv("ANSWERS_FIRST_CORRECT_WINS", "false").lower() in ["true", "1", "yes"]
 
-# Registrar el blueprint de endpoints de los informes de usuario
-from endpoints.epUsersReport import report_bp
-app.register_blueprint(report_bp)
+    # Cache HTTP de unidades y preguntas (ver http_cache.py)
+    app.config["CATALOG_CACHE_CONTROL"] = os.getenv("CATALOG_CACHE_CONTROL", "no-cache")
+    app.config["COMPRESS_MIN_SIZE"] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+
+
+def mongo_client_options(app):
+    """Opciones del MongoClient a partir de la configuración."""
+    return {
+        "maxPoolSize": app.config["MONGO_MAX_POOL_SIZE"],
+        "minPoolSize": app.config["MONGO_MIN_POOL_SIZE"],
+        "maxIdleTimeMS": app.config["MONGO_MAX_IDLE_TIME_MS"],
+        "connectTimeoutMS": app.config["MONGO_CONNECT_TIMEOUT_MS"],
+        "serverSelectionTimeoutMS": app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+        "waitQueueTimeoutMS": app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"]
+    }
+
+
+def create_app():
+    """
+    Crea la aplicación. Con Gunicorn (ver wsgi.py y gunicorn.conf.py) se llama
+    una vez por worker, después del fork, así cada proceso abre su propio
+    cliente de MongoDB, sus pools y sus hilos.
+    """
+    app = Flask(__name__)
+    load_config(app)
+    CORS(app)
+
+    # Inicializamos las extensiones con la app
+    import monitoring
+    monitoring.pool_monitor.max_pool_size = app.config["MONGO_MAX_POOL_SIZE"]
+    mongo.init_app(
+        app,
+        event_listeners=[monitoring.pool_monitor, monitoring.command_monitor],
+        **mongo_client_options(app)
+    )
+    JWTManager(app)
+    Mail(app)
+
+    # Latencia, tamaños y consultas a MongoDB por ruta: header Server-Timing y GET /metrics
+    monitoring.init_app(app)
+
+    # Cohorte de cada request: X-Cohort, ?cohort= o CURRENT_COHORT (ver cohorts.py)
+    import cohorts
+    cohorts.init_app(app)
+
+    # JSON con orjson y soporte para ObjectId/datetime (ver json_provider.py)
+    from json_provider import BSONJSONProvider, json_benchmark_command
+    app.json = BSONJSONProvider(app)
+
+    import passwords
+    passwords.configure(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_queue=app.config["PASSWORD_HASH_MAX_QUEUE"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"]
+    )
+
+    # Índices que necesitan las consultas de la API (ver indexes.py)
+    from indexes import ensure_indexes, indexes_command
+    ensure_indexes(app.logger, app.config)
+
+    # Los correos se encolan en mail_outbox y los envían estos hilos (ver outbox.py).
+    # Se lanzan con el primer request, así no corren durante los comandos de `flask`.
+    from outbox import start_outbox_workers, outbox_drain_command
+    outbox_lock = threading.Lock()
+    outbox_workers = []
+
+    @app.before_request
+    def start_outbox():
+        if outbox_workers or app.config["MAIL_OUTBOX_WORKERS"] <= 0:
+            return
+        with outbox_lock:
+            if not outbox_workers:
+                outbox_workers.append(start_outbox_workers(
+                    app, app.config["MAIL_OUTBOX_WORKERS"], app.config["MAIL_OUTBOX_BATCH"]
+                ))
+
+    # Registrar el blueprint de endpoints de usuarios
+    from endpoints.epUsers import users_bp
+    app.register_blueprint(users_bp)
+
+    # Registrar el blueprint de endpoints de las unidades
+    from endpoints.epUnits import units_bp
+    app.register_blueprint(units_bp)
+
+    # Registrar el blueprint de endpoints de las preguntas
+    from endpoints.epQuestions import questions_bp
+    app.register_blueprint(questions_bp)
+
+    # Registrar el blueprint de endpoints de las respuestas
+    from endpoints.epAnswers import answers_bp
+    app.register_blueprint(answers_bp)
+
+    # Registrar el blueprint de endpoints de los informes de usuario
+    from endpoints.epUsersReport import report_bp
+    app.register_blueprint(report_bp)
+
+    # Registrar el blueprint de los rankings
+    from endpoints.epLeaderboard import leaderboard_bp
+    app.register_blueprint(leaderboard_bp)
+
+    # Registrar el blueprint de salud (/health/live y /health/ready)
+    from endpoints.epHealth import health_bp
+    app.register_blueprint(health_bp)
+
+    # Comandos de mantenimiento (flask --app app <comando>)
+    from experience import reconcile_exp_command
+    from progress import rebuild_progress_command
+    from leaderboard import rebuild_leaderboard_command
+    from cleanup import gc_orphans_command
+    from question_stats import backfill_question_stats_command
+    app.cli.add_command(reconcile_exp_command)
+    app.cli.add_command(rebuild_progress_command)
+    app.cli.add_command(rebuild_leaderboard_command)
+    app.cli.add_command(gc_orphans_command)
+    app.cli.add_command(backfill_question_stats_command)
+    app.cli.add_command(cohorts.assign_cohort_command)
+    app.cli.add_command(indexes_command)
+    app.cli.add_command(outbox_drain_command)
+    app.cli.add_command(passwords.hash_benchmark_command)
+    app.cli.add_command(json_benchmark_command)
+
+    @app.route('/', methods=['GET'])
+    def home():
+        return jsonify({"message": "¡Hola desde la API Flask!"})
+
+    @app.route('/catalog/stats', methods=['GET'])
+    def catalog_stats():
+        # Versión y aciertos/fallos de la cache del catálogo en este worker
+        return jsonify(catalog.stats())
+
+    @app.route('/passwords/stats', methods=['GET'])
+    def passwords_stats():
+        # Profundidad de la cola del pool de hasheo en este worker
+        return jsonify(passwords.stats())
+
+    return app
 
-@app.route('/', methods=['GET'])
-def home():
-    return jsonify({"message": "¡Hola desde la API Flask!"})
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
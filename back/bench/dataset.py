@@ -0,0 +1,200 @@
+"""
+Genera un dataset sintético (y reproducible con --seed) para pruebas de carga:
+unidades, preguntas Choice y OpenEntry con hints, usuarios, respuestas y
+ayudas usadas, con la exp ya registrada en exp_ledger, users.exp y
+unit_scores (con su histograma en exp_buckets), y el progreso en user_progress.
+
+    python bench/dataset.py --uri mongodb://localhost:27017/trp_bench --users 5000 --questions 300 --drop
+
+Todos los usuarios tienen la misma contraseña (--password) y DNI correlativos
+desde --first-dni, así bench/harness.py puede iniciar sesión con cualquiera.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from bson import ObjectId
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from experience import compute_awarded_exp  # noqa: E402
+from leaderboard import unit_key  # noqa: E402
+
+NAMES = ["Ana", "Juan", "María", "Lucas", "Sofía", "Mateo", "Valentina", "Martín", "Camila", "Tomás",
+         "Julieta", "Nicolás", "Lucía", "Santiago", "Martina", "Agustín", "Florencia", "Facundo"]
+LASTNAMES = ["González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez",
+             "García", "Sánchez", "Romero", "Sosa", "Torres", "Álvarez", "Ruiz", "Ramírez"]
+WORDS = ["pila", "cola", "grafo", "árbol", "lista", "vector", "matriz", "puntero", "registro", "archivo"]
+
+DATASET_COLLECTIONS = ("units", "questions", "users", "answers", "question_helps", "question_attempts", "exp_ledger",
+                       "user_progress", "unit_scores", "exp_buckets")
+INSERT_BATCH = 10000
+
+
+def make_units(rng, count):
+    return [{"_id": ObjectId(), "title": f"Unidad {i + 1}", "level": i + 1} for i in range(count)]
+
+
+def make_question(rng, unit_id, index):
+    question = {
+        "_id": ObjectId(),
+        "unit_id": unit_id,
+        "exp": rng.choice((10, 20, 30, 50, 100)),
+        "body": f"Pregunta {index + 1}: " + " ".join(rng.choices(WORDS, k=8))
+    }
+    if rng.random() < 0.6:
+        correct = rng.randrange(4)
+        question["type"] = "Choice"
+        question["options"] = [
+            {"body": f"Opción {i + 1}", "isCorrect": i == correct} for i in range(4)
+        ]
+    else:
+        question["type"] = "OpenEntry"
+        if rng.random() < 0.5:
+            question["expectedAnswer"] = str(rng.randint(1, 1000))
+            question["tolerance"] = rng.choice((0, 0.5, 1))
+        else:
+            word = rng.choice(WORDS)
+            question["expectedAnswer"] = word
+            question["acceptedAnswers"] = [word.upper(), f"la {word}"]
+    for i in (1, 2):
+        if rng.random() < 0.7:
+            question[f"hint{i}"] = {"text": f"Ayuda {i}", "penalty": rng.choice((0.1, 0.2, 0.3))}
+    return question
+
+
+def make_answer(rng, question, user_id, correct):
+    """Una respuesta a `question`, correcta o no según `correct`."""
+    answer = {"_id": ObjectId(), "question_id": question["_id"], "user_id": user_id, "correct": correct}
+    if question["type"] == "Choice":
+        options = question["options"]
+        right = next(i for i, o in enumerate(options) if o["isCorrect"])
+        wrong = [i for i in range(len(options)) if i != right]
+        answer["selectedOption"] = str(right if correct else rng.choice(wrong))
+    elif correct:
+        answer["body"] = rng.choice([question["expectedAnswer"]] + question.get("acceptedAnswers", []))
+    else:
+        answer["body"] = "no sé"
+    return answer
+
+
+def insert_batched(collection, docs):
+    for start in range(0, len(docs), INSERT_BATCH):
+        collection.insert_many(docs[start:start + INSERT_BATCH], ordered=False)
+
+
+def generate(db, users=5000, units=10, questions=300, answers_per_user=60, correct_rate=0.6,
+             help_rate=0.2, password="bench1234", first_dni=30000000, seed=1, drop=False, log=print):
+    """
+    Carga el dataset en `db` (una base de pymongo o mongomock) y devuelve
+    cuántos documentos insertó por colección.
+    """
+    rng = random.Random(seed)
+    if drop:
+        for name in DATASET_COLLECTIONS:
+            db[name].delete_many({})
+    elif db.users.estimated_document_count():
+        raise RuntimeError("La base ya tiene usuarios; usá --drop para reemplazarlos")
+
+    unit_docs = make_units(rng, units)
+    question_docs = [
+        make_question(rng, unit_docs[i % units]["_id"], i) for i in range(questions)
+    ]
+
+    # un único hash para todos: el login verifica igual y generar el dataset es instantáneo
+    password_hash = generate_password_hash(password)
+    user_docs = []
+    answer_docs = []
+    help_docs = []
+    ledger_docs = []
+    progress_docs = []
+    score_docs = []
+    per_user = min(answers_per_user, questions)
+    for i in range(users):
+        user_id = ObjectId()
+        total_exp = 0
+        solved = {}
+        unit_exp = {}
+        for question in rng.sample(question_docs, per_user):
+            help_doc = None
+            if rng.random() < help_rate:
+                help_doc = {"_id": ObjectId(), "user_id": user_id, "question_id": question["_id"]}
+                for h in (1, 2):
+                    if f"hint{h}" in question and (h == 1 or rng.random() < 0.5):
+                        help_doc[f"usedHelp{h}"] = True
+                help_docs.append(help_doc)
+
+            correct = rng.random() < correct_rate
+            if correct and rng.random() < 0.3:
+                # a veces hay un intento fallido antes de acertar
+                answer_docs.append(make_answer(rng, question, user_id, False))
+            answer_docs.append(make_answer(rng, question, user_id, correct))
+            if correct:
+                exp = compute_awarded_exp(question, help_doc)
+                total_exp += exp
+                ledger_docs.append({"user_id": user_id, "question_id": question["_id"], "exp": exp, "correct": 1})
+                solved.setdefault(str(question["unit_id"]), []).append(question["_id"])
+                unit_exp[question["unit_id"]] = unit_exp.get(question["unit_id"], 0) + exp
+
+        user_docs.append({
+            "_id": user_id,
+            "DNI": str(first_dni + i),
+            "name": rng.choice(NAMES),
+            "lastname": rng.choice(LASTNAMES),
+            "email": f"alumno{i}@example.com",
+            "password": password_hash,
+            "role": "user",
+            "exp": total_exp
+        })
+        if solved:
+            progress_docs.append({"_id": user_id, "units": solved})
+        for unit_id, exp in unit_exp.items():
+            score_docs.append({"unit_id": unit_id, "user_id": user_id, "exp": exp})
+
+    # histograma de los rankings (ver leaderboard.py): los usuarios no tienen cohorte
+    buckets = {}
+    for key, exp in [("users", u["exp"]) for u in user_docs] + [(unit_key(s["unit_id"]), s["exp"]) for s in score_docs]:
+        buckets[(key, exp)] = buckets.get((key, exp), 0) + 1
+    bucket_docs = [{"board": key, "exp": exp, "count": count} for (key, exp), count in buckets.items()]
+
+    counts = {}
+    for name, docs in (("units", unit_docs), ("questions", question_docs), ("users", user_docs),
+                       ("answers", answer_docs), ("question_helps", help_docs), ("exp_ledger", ledger_docs),
+                       ("user_progress", progress_docs), ("unit_scores", score_docs), ("exp_buckets", bucket_docs)):
+        start = time.perf_counter()
+        insert_batched(db[name], docs)
+        counts[name] = len(docs)
+        log(f"{name:15} {len(docs):9} docs  {time.perf_counter() - start:6.1f} s")
+
+    # las caches del catálogo de las APIs levantadas se recargan con la nueva versión
+    db.meta.update_one({"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="Por defecto MONGO_URI")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--units", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--answers-per-user", type=int, default=60)
+    parser.add_argument("--correct-rate", type=float, default=0.6)
+    parser.add_argument("--help-rate", type=float, default=0.2)
+    parser.add_argument("--password", default="bench1234")
+    parser.add_argument("--first-dni", type=int, default=30000000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drop", action="store_true", help="Borra antes los datos de las colecciones del dataset")
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error("falta --uri (o MONGO_URI)")
+
+    from pymongo import MongoClient
+    db = MongoClient(args.uri).get_default_database()
+    generate(db, args.users, args.units, args.questions, args.answers_per_user, args.correct_rate,
+             args.help_rate, args.password, args.first_dni, args.seed, args.drop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Benchmark de los endpoints principales: para cada escenario hace --requests
+pedidos con --concurrency hilos e informa req/s y latencias p50/p95/p99.
+
+Contra una API levantada y cargada con bench/dataset.py:
+
+    python bench/harness.py --base-url http://localhost:5000
+
+O todo en el proceso, sin servidor ni mongod, con mongomock (pip install mongomock);
+genera el dataset (--users, --questions) en memoria antes de medir:
+
+    python bench/harness.py --mongomock --users 500 --questions 100
+
+--json guarda los resultados para comparar corridas.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+SCENARIOS = ("login", "profile", "users", "users_report", "user_progress", "answer",
+             "leaderboard", "leaderboard_unit", "leaderboard_me")
+
+
+class HttpClient:
+    """Pedidos a una API levantada (urllib, una conexión por pedido)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class InProcessClient:
+    """Pedidos con el test client de Flask (uno por hilo), sin red."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        resp = client.open(path, method=method, json=body, headers=headers)
+        return resp.status_code, resp.get_data()
+
+
+def mongomock_app(args):
+    """Crea la app sobre mongomock y genera el dataset en memoria."""
+    import mongomock
+    import flask_pymongo
+
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/trp_bench")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["MAIL_OUTBOX_WORKERS"] = "0"
+    flask_pymongo.MongoClient = mongomock.MongoClient
+
+    from app import create_app
+    from extensions import mongo
+    from dataset import generate
+
+    app = create_app()
+    generate(mongo.db, users=args.users, questions=args.questions, password=args.password,
+             first_dni=args.first_dni, seed=args.seed, drop=True)
+    return app
+
+
+def percentile(sorted_values, p):
+    """Percentil p (0-100) por el método del rango más cercano."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def fetch_all(client, path):
+    """Recorre un listado paginado (limit/after) y devuelve todos sus items."""
+    items, token = [], None
+    while True:
+        sep = "&" if "?" in path else "?"
+        page_path = f"{path}{sep}limit=1000" + (f"&after={token}" if token else "")
+        status, body = client.request("GET", page_path)
+        if status != 200:
+            raise RuntimeError(f"GET {page_path} respondió {status}: {body[:200]!r}")
+        page = json.loads(body)
+        items.extend(page["items"])
+        token = page["next"]
+        if not token:
+            return items
+
+
+def prepare(client, args, rng):
+    """Usuarios, preguntas y tokens que usan los escenarios."""
+    users = fetch_all(client, "/users?fields=DNI")
+    questions = fetch_all(client, "/questions?fields=type,options,unit_id")
+    if not users or not questions:
+        raise RuntimeError("No hay usuarios o preguntas; generá el dataset con bench/dataset.py")
+
+    tokens = []
+    for user in rng.sample(users, min(args.logged_users, len(users))):
+        status, body = client.request("POST", "/login", {"DNI": user["DNI"], "password": args.password})
+        if status != 200:
+            raise RuntimeError(f"No se pudo iniciar sesión con {user['DNI']} ({status}); ¿--password?")
+        tokens.append(json.loads(body)["access_token"])
+    return users, questions, tokens
+
+
+def make_scenarios(users, questions, tokens, args):
+    """Cada escenario es una función (rng) -> (method, path, body, token)."""
+
+    def answer(rng):
+        question = rng.choice(questions)
+        body = {"question_id": question["_id"], "user_id": rng.choice(users)["user_id"]}
+        if question["type"] == "Choice":
+            body["selectedOption"] = str(rng.randrange(len(question.get("options") or [None])))
+        else:
+            body["body"] = str(rng.randint(1, 1000))
+        return "POST", "/answers", body, None
+
+    return {
+        "login": lambda rng: ("POST", "/login", {"DNI": rng.choice(users)["DNI"], "password": args.password}, None),
+        "profile": lambda rng: ("GET", "/profile", None, rng.choice(tokens)),
+        "users": lambda rng: ("GET", f"/users?limit={args.page_size}", None, None),
+        "users_report": lambda rng: ("GET", f"/users/report?user_id={rng.choice(users)['user_id']}", None, None),
+        "user_progress": lambda rng: ("GET", "/user-progress", None, rng.choice(tokens)),
+        "answer": answer,
+        "leaderboard": lambda rng: ("GET", "/leaderboard?limit=10", None, None),
+        "leaderboard_unit": lambda rng: ("GET", f"/leaderboard?unit_id={rng.choice(questions)['unit_id']}", None, None),
+        "leaderboard_me": lambda rng: ("GET", "/leaderboard/me", None, rng.choice(tokens)),
+    }
+
+
+def run_scenario(client, scenario, requests, concurrency, seed):
+    def worker(i):
+        method, path, body, token = scenario(random.Random(seed * 1000003 + i))
+        start = time.perf_counter()
+        status, _ = client.request(method, path, body, token)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    return {
+        "requests": requests,
+        "errors": sum(1 for r in results if r[1] >= 400),
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--mongomock", action="store_true", help="App y base en memoria en este proceso")
+    parser.add_argument("--users", type=int, default=500, help="Tamaño del dataset con --mongomock")
+    parser.add_argument("--questions", type=int, default=100, help="Tamaño del dataset con --mongomock")
+    parser.add_argument("--password", default="bench1234", help="Contraseña del dataset")
+    parser.add_argument("--first-dni", type=int, default=30000000)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Separados por coma: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="Pedidos por escenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20, help="Pedidos por escenario que no se miden")
+    parser.add_argument("--logged-users", type=int, default=50, help="Usuarios con sesión para /profile y /user-progress")
+    parser.add_argument("--page-size", type=int, default=100, help="limit de GET /users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error("escenarios desconocidos: " + ", ".join(sorted(unknown)))
+
+    client = InProcessClient(mongomock_app(args)) if args.mongomock else HttpClient(args.base_url)
+    rng = random.Random(args.seed)
+    scenarios = make_scenarios(*prepare(client, args, rng), args)
+
+    results = {}
+    for name in names:
+        if args.warmup:
+            run_scenario(client, scenarios[name], args.warmup, args.concurrency, args.seed + 1)
+        r = results[name] = run_scenario(client, scenarios[name], args.requests, args.concurrency, args.seed)
+        print(f"{name:14} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms  "
+              f"p99 {r['p99_ms']:7.1f} ms  errores {r['errors']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
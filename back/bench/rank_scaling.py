@@ -0,0 +1,120 @@
+"""
+Mide cuánto cuesta la posición en el ranking (Board.entry + Board.around, ver
+leaderboard.py) a medida que crece la cantidad de usuarios, contra el conteo
+de usuarios por encima que se hacía antes del histograma exp_buckets.
+
+Para cada tamaño de --sizes carga un ranking sintético en su propia colección
+(rank_bench_users, con el mismo índice (exp desc, _id) que users) y su
+histograma, y toma --samples usuarios al azar:
+
+    python bench/rank_scaling.py --uri mongodb://localhost:27017/trp_bench --sizes 10000,100000
+
+"histograma" es la posición y el conteo de los de abajo desde exp_buckets,
+"around" la respuesta completa de /leaderboard/me (con los vecinos) y
+"conteo" el count_documents de antes. Con --mongomock no hay índices y todo
+recorre la colección, así que sólo la columna "histograma" es comparable.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from bson import ObjectId
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+COLLECTION = "rank_bench_users"
+BOARD_KEY = "rank_bench"
+
+
+def make_app(args):
+    if args.mongomock:
+        import mongomock
+        import flask_pymongo
+        flask_pymongo.MongoClient = mongomock.MongoClient
+        os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/trp_bench")
+    else:
+        os.environ["MONGO_URI"] = args.uri
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["MAIL_OUTBOX_WORKERS"] = "0"
+
+    from app import create_app
+    return create_app()
+
+
+def load(db, size, rng):
+    """Carga `size` usuarios con exp al azar (unos miles de valores distintos) y su histograma."""
+    db[COLLECTION].drop()
+    db.exp_buckets.delete_many({"board": BOARD_KEY})
+    db[COLLECTION].create_index([("exp", -1), ("_id", 1)], name="exp_rank")
+    docs = [{"_id": ObjectId(), "exp": max(0, int(rng.gauss(1500, 500)))} for _ in range(size)]
+    for start in range(0, size, 10000):
+        db[COLLECTION].insert_many(docs[start:start + 10000], ordered=False)
+    buckets = {}
+    for d in docs:
+        buckets[d["exp"]] = buckets.get(d["exp"], 0) + 1
+    db.exp_buckets.insert_many([{"board": BOARD_KEY, "exp": exp, "count": n} for exp, n in buckets.items()])
+    return docs, len(buckets)
+
+
+def timed(fn, samples):
+    """Mediana en ms de `fn(doc)` sobre `samples`."""
+    times = []
+    for doc in samples:
+        start = time.perf_counter()
+        fn(doc)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI"), help="Por defecto MONGO_URI")
+    parser.add_argument("--mongomock", action="store_true", help="Base en memoria (sin índices)")
+    parser.add_argument("--sizes", default="10000,100000", help="Cantidades de usuarios, separadas por coma")
+    parser.add_argument("--samples", type=int, default=200, help="Usuarios medidos por tamaño")
+    parser.add_argument("--neighbours", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not args.mongomock and not args.uri:
+        parser.error("falta --uri (o MONGO_URI) o --mongomock")
+
+    app = make_app(args)
+    from extensions import mongo
+    from leaderboard import Board
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db = mongo.db
+        board = Board(COLLECTION, {}, "_id", BOARD_KEY)
+
+        def histogram(doc):
+            return board._sum({"$gt": doc["exp"]}) + 1, board._sum({"$lt": doc["exp"]})
+
+        def around(doc):
+            entry = board.entry(doc["_id"])
+            return board.around(doc["_id"], entry["exp"], args.neighbours)
+
+        def count(doc):
+            coll = db[COLLECTION]
+            return (coll.count_documents({"exp": {"$gt": doc["exp"]}})
+                    + coll.count_documents({"exp": doc["exp"], "_id": {"$lt": doc["_id"]}}) + 1,
+                    coll.count_documents({"exp": {"$lt": doc["exp"]}}))
+
+        print(f"{'usuarios':>9} {'buckets':>8} {'histograma':>11} {'around':>9} {'conteo':>9}   (mediana, ms)")
+        try:
+            for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+                docs, distinct = load(db, size, rng)
+                samples = rng.sample(docs, min(args.samples, size))
+                print(f"{size:9} {distinct:8} {timed(histogram, samples):11.2f} "
+                      f"{timed(around, samples):9.2f} {timed(count, samples):9.2f}")
+        finally:
+            db[COLLECTION].drop()
+            db.exp_buckets.delete_many({"board": BOARD_KEY})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# catalog.py
+#
+# Cache en memoria del catálogo (preguntas y unidades). El catálogo cambia
+# pocas veces por semana pero se lee en casi todos los requests, así que cada
+# worker guarda una copia y sólo la recarga cuando cambia la versión guardada
+# en `meta` (documento {_id: "catalog", version: n}). Los endpoints que
+# modifican preguntas o unidades llaman a catalog.invalidate().
+import threading
+import time
+
+from extensions import mongo
+
+
+class CatalogCache:
+    def __init__(self, check_interval=1.0):
+        # cada cuántos segundos se consulta la versión en MongoDB
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._questions = {}
+        self._by_unit = {}
+        self._units = []
+        self._units_by_id = {}
+
+    def _stored_version(self):
+        meta = mongo.db.meta.find_one({"_id": "catalog"}, {"version": 1}) or {}
+        return meta.get("version", 0)
+
+    def _load(self, version):
+        questions = {q["_id"]: q for q in mongo.db.questions.find()}
+        by_unit = {}
+        for q in questions.values():
+            by_unit.setdefault(q.get("unit_id"), []).append(q)
+        self._questions = questions
+        self._by_unit = by_unit
+        self._units = list(mongo.db.units.find())
+        self._units_by_id = {u["_id"]: u for u in self._units}
+        self._version = version
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            self.hits += 1
+            return
+        with self._lock:
+            version = self._stored_version()
+            self._checked_at = now
+            if version == self._version:
+                self.hits += 1
+                return
+            self.misses += 1
+            self._load(version)
+
+    @property
+    def version(self):
+        """Versión del catálogo actualmente en memoria."""
+        self._ensure_fresh()
+        return self._version
+
+    def questions(self):
+        """Dict {ObjectId: pregunta}. Los documentos son compartidos: no modificarlos."""
+        self._ensure_fresh()
+        return self._questions
+
+    def question(self, question_id):
+        self._ensure_fresh()
+        q = self._questions.get(question_id)
+        if q is None:
+            # puede haberse creado en otro worker antes de chequear la versión
+            q = mongo.db.questions.find_one({"_id": question_id})
+        return q
+
+    def questions_by_unit(self, unit_id):
+        self._ensure_fresh()
+        return self._by_unit.get(unit_id, [])
+
+    def units(self, cohort=None):
+        """Unidades del catálogo; con `cohort`, sólo las de esa cohorte (ver cohorts.py)."""
+        self._ensure_fresh()
+        if cohort:
+            return [u for u in self._units if u.get("cohort") == cohort]
+        return self._units
+
+    def unit(self, unit_id):
+        self._ensure_fresh()
+        return self._units_by_id.get(unit_id)
+
+    def invalidate(self):
+        """Incrementa la versión en MongoDB para que todos los workers recarguen."""
+        mongo.db.meta.update_one({"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True)
+        with self._lock:
+            self._version = None
+
+    def stats(self):
+        return {"version": self._version, "hits": self.hits, "misses": self.misses}
+
+
+catalog = CatalogCache()
@@ -0,0 +1,247 @@
+# cleanup.py
+#
+# Borrado en cascada y recolección de huérfanos. Al borrar un usuario, una
+# pregunta o una unidad, los endpoints llaman a cascade_* para borrar con
+# operaciones masivas todo lo que cuelga de ellos (respuestas, ayudas, libro
+# mayor, progreso y rankings), descontando la exp que se había otorgado.
+# Para los datos que quedaron huérfanos de antes, `flask --app app gc-orphans`
+# recorre las colecciones por lotes y borra las filas cuyo padre ya no existe;
+# si borra exp de preguntas que ya no están, recalcula la de esos usuarios.
+import time
+
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+
+from extensions import mongo
+from catalog import catalog
+from cohorts import cohort_of
+from experience import cohort_exp
+from leaderboard import inc_user_exp, inc_unit_score, move_buckets, user_moves, unit_key, rebuild_exp_buckets
+from question_stats import user_stats_ops
+
+# (colección, campo, colección padre) en el orden en que se revisan: primero
+# las preguntas, así sus respuestas y ayudas quedan huérfanas en la misma corrida
+ORPHAN_CHECKS = [
+    ("questions", "unit_id", "units"),
+    ("answers", "user_id", "users"),
+    ("answers", "question_id", "questions"),
+    ("question_helps", "user_id", "users"),
+    ("question_helps", "question_id", "questions"),
+    ("question_attempts", "user_id", "users"),
+    ("question_attempts", "question_id", "questions"),
+    ("exp_ledger", "user_id", "users"),
+    ("exp_ledger", "question_id", "questions"),
+    ("unit_scores", "user_id", "users"),
+    ("unit_scores", "unit_id", "units"),
+    ("user_progress", "_id", "users"),
+    ("question_stats", "_id", "questions"),
+]
+
+# colecciones que referencian a un usuario, con el campo que lo hace
+USER_REFS = [
+    ("answers", "user_id"),
+    ("question_helps", "user_id"),
+    ("question_attempts", "user_id"),
+    ("exp_ledger", "user_id"),
+    ("unit_scores", "user_id"),
+    ("user_progress", "_id"),
+]
+
+# colecciones que referencian a una pregunta
+QUESTION_REFS = ["answers", "question_helps", "question_attempts", "exp_ledger"]
+
+
+def revoke_ledger(rows, questions, cohorts=None):
+    """
+    Descuenta la exp de filas de exp_ledger que se van a borrar de users.exp,
+    del puntaje de la unidad y del progreso del usuario, con bulk_write.
+    `questions` es {question_id: pregunta} con todas las de las filas.
+    users.exp sólo suma la cohorte del usuario (ver experience.py), así que
+    sólo se descuenta a los usuarios de la cohorte de la pregunta: la de
+    `cohorts` ({question_id: cohorte}) o, si no está, la de su unidad en el
+    catálogo. Si la unidad se borra, hay que leer su cohorte antes y pasarla.
+    users y unit_scores se actualizan de a uno para mover el histograma de
+    los rankings (ver leaderboard.py).
+    """
+    cohorts = cohorts or {}
+    by_user = {}
+    by_unit = {}
+    pulls = {}
+    for row in rows:
+        uid, exp = row["user_id"], row.get("exp", 0)
+        q = questions[row["question_id"]]
+        cohort = cohorts[q["_id"]] if q["_id"] in cohorts else cohort_of(q)
+        by_user[(uid, cohort)] = by_user.get((uid, cohort), 0) + exp
+        key = (q.get("unit_id"), uid)
+        by_unit[key] = by_unit.get(key, 0) + exp
+        pulls.setdefault(uid, {}).setdefault(f"units.{q.get('unit_id')}", []).append(q["_id"])
+
+    db = mongo.db
+    moves = []
+    for (uid, cohort), exp in by_user.items():
+        moves += inc_user_exp(uid, cohort, -exp)
+    for (unit_id, uid), exp in by_unit.items():
+        moves += inc_unit_score(uid, unit_id, -exp, upsert=False)
+    move_buckets(moves)
+    if pulls:
+        db.user_progress.bulk_write([
+            UpdateOne({"_id": uid}, {"$pull": {k: {"$in": v} for k, v in units.items()}})
+            for uid, units in pulls.items()
+        ], ordered=False)
+
+
+def resync_users(user_ids, question_ids):
+    """
+    Para filas de exp_ledger huérfanas (de preguntas que ya no existen, así
+    que no se sabe su unidad ni su cohorte), ya borradas: recalcula users.exp
+    y los puntajes por unidad de `user_ids` desde lo que queda en el libro
+    mayor y saca `question_ids` de su progreso.
+    """
+    db = mongo.db
+    questions = catalog.questions()
+    moves = []
+    for u in db.users.find({"_id": {"$in": user_ids}}, {"cohort": 1}):
+        exp = cohort_exp(u["_id"], u.get("cohort"))
+        before = db.users.find_one_and_update({"_id": u["_id"]}, {"$set": {"exp": exp}},
+                                              projection={"exp": 1, "cohort": 1})
+        if before:
+            moves += user_moves(before, {"exp": exp})
+
+    totals = {}
+    for row in db.exp_ledger.find({"user_id": {"$in": user_ids}}, {"user_id": 1, "question_id": 1, "exp": 1}):
+        q = questions.get(row["question_id"])
+        if q:
+            key = (q.get("unit_id"), row["user_id"])
+            totals[key] = totals.get(key, 0) + row.get("exp", 0)
+    for score in list(db.unit_scores.find({"user_id": {"$in": user_ids}}, {"unit_id": 1, "user_id": 1})):
+        exp = totals.get((score["unit_id"], score["user_id"]), 0)
+        before = db.unit_scores.find_one_and_update({"_id": score["_id"]}, {"$set": {"exp": exp}},
+                                                    projection={"exp": 1})
+        if before:
+            moves.append(([unit_key(score["unit_id"])], before.get("exp", 0), exp))
+    move_buckets(moves)
+
+    pulls = [
+        UpdateOne({"_id": p["_id"]}, {"$pull": {f"units.{k}": {"$in": question_ids} for k in p["units"]}})
+        for p in db.user_progress.find({"_id": {"$in": user_ids}}, {"units": 1}) if p.get("units")
+    ]
+    if pulls:
+        db.user_progress.bulk_write(pulls, ordered=False)
+
+
+def cascade_delete_user(user_id):
+    """
+    Borra todo lo que referencia al usuario (ya borrado de `users`, que
+    saca del histograma quien lo borra con user_moves), descontando antes lo
+    que aportaba a las estadísticas por pregunta y a los rankings por unidad.
+    """
+    ops = user_stats_ops(user_id)
+    if ops:
+        mongo.db.question_stats.bulk_write(ops, ordered=False)
+    # sus puntajes por unidad salen de los rankings
+    move_buckets([
+        ([unit_key(s["unit_id"])], s.get("exp", 0), None)
+        for s in mongo.db.unit_scores.find({"user_id": user_id}, {"unit_id": 1, "exp": 1})
+    ])
+    for collection, field in USER_REFS:
+        mongo.db[collection].delete_many({field: user_id})
+
+
+def cascade_delete_questions(questions, cohorts=None):
+    """
+    Borra respuestas, ayudas y libro mayor de las preguntas (ya borradas de
+    `questions`), descontando la exp que habían otorgado. `cohorts` como en
+    revoke_ledger.
+    """
+    ids = [q["_id"] for q in questions]
+    if not ids:
+        return
+    rows = list(mongo.db.exp_ledger.find({"question_id": {"$in": ids}}, {"user_id": 1, "question_id": 1, "exp": 1}))
+    revoke_ledger(rows, {q["_id"]: q for q in questions}, cohorts)
+    for collection in QUESTION_REFS:
+        mongo.db[collection].delete_many({"question_id": {"$in": ids}})
+    mongo.db.question_stats.delete_many({"_id": {"$in": ids}})
+
+
+def cascade_delete_unit(unit_id, cohort):
+    """
+    Borra las preguntas de la unidad (ya borrada de `units`) con todo lo que
+    cuelga de ellas. `cohort` es la que tenía la unidad: el catálogo ya no la conoce.
+    """
+    questions = list(mongo.db.questions.find({"unit_id": unit_id}, {"unit_id": 1}))
+    mongo.db.questions.delete_many({"unit_id": unit_id})
+    cascade_delete_questions(questions, {q["_id"]: cohort for q in questions})
+    mongo.db.unit_scores.delete_many({"unit_id": unit_id})
+    mongo.db.exp_buckets.delete_many({"board": unit_key(unit_id)})
+    mongo.db.user_progress.update_many(
+        {f"units.{unit_id}": {"$exists": True}}, {"$unset": {f"units.{unit_id}": ""}}
+    )
+    return len(questions)
+
+
+def _ids(collection):
+    return {d["_id"] for d in mongo.db[collection].find({}, {"_id": 1})}
+
+
+def collect_orphans(batch_size=1000, rate=None, dry_run=False, log=None):
+    """
+    Recorre las colecciones de ORPHAN_CHECKS por lotes de `batch_size` (en
+    orden de _id) y borra las filas que referencian a un padre inexistente.
+    `rate` limita los borrados por segundo para no competir con la API.
+    Con dry_run sólo cuenta. Devuelve {"colección.campo": cantidad}.
+    """
+    db = mongo.db
+    removed = {}   # ids borrados (o que se borrarían) por colección
+    report = {}
+    for collection, field, parent in ORPHAN_CHECKS:
+        parents = _ids(parent) - removed.get(parent, set())
+        found = 0
+        last_id = None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            batch = list(db[collection].find(query, {field: 1, "user_id": 1, "question_id": 1, "exp": 1})
+                         .sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+
+            already = removed.get(collection, ())
+            orphans = [d for d in batch if field in d and d[field] not in parents and d["_id"] not in already]
+            if not orphans:
+                continue
+            found += len(orphans)
+            orphan_ids = [d["_id"] for d in orphans]
+            removed.setdefault(collection, set()).update(orphan_ids)
+            if dry_run:
+                continue
+
+            db[collection].delete_many({"_id": {"$in": orphan_ids}})
+            if collection == "exp_ledger" and field == "question_id":
+                # la pregunta ya no existe (ni su unidad en el catálogo): se
+                # recalcula lo de esos usuarios con lo que queda
+                resync_users(list({d["user_id"] for d in orphans}), list({d["question_id"] for d in orphans}))
+            if rate:
+                time.sleep(len(orphan_ids) / rate)
+
+        report[f"{collection}.{field}"] = found
+        if log:
+            log(f"{collection}.{field}: {found} huérfanos" + (" (dry run)" if dry_run else " borrados"))
+
+    if report.get("questions.unit_id") and not dry_run:
+        catalog.invalidate()
+    if any(report.values()) and not dry_run:
+        # puntajes y usuarios borrados sin pasar por move_buckets
+        rebuild_exp_buckets()
+    return report
+
+
+@click.command("gc-orphans")
+@click.option("--dry-run", is_flag=True, help="Sólo informa cuántos huérfanos hay.")
+@click.option("--batch-size", default=1000, show_default=True, help="Documentos leídos por lote.")
+@click.option("--rate", default=2000, show_default=True, help="Máximo de borrados por segundo (0 sin límite).")
+@with_appcontext
+def gc_orphans_command(dry_run, batch_size, rate):
+    """Borra respuestas, ayudas, preguntas y demás filas que referencian a algo ya borrado."""
+    report = collect_orphans(batch_size=batch_size, rate=rate or None, dry_run=dry_run, log=click.echo)
+    click.echo(f"{sum(report.values())} huérfanos en total")
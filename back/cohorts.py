@@ -0,0 +1,138 @@
+# cohorts.py
+#
+# Cohortes: curso y cuatrimestre, p.ej. "TRP-2025-1". Usuarios, unidades y
+# respuestas llevan un campo `cohort` y los listados, el informe y el ranking
+# global se limitan a la cohorte del request: header X-Cohort, parámetro
+# ?cohort= o, si no viene ninguno, CURRENT_COHORT de la configuración. Con
+# "*" (o sin cohorte configurada) se ve todo, como antes de las cohortes. Los
+# índices que empiezan por cohort (ver indexes.py) hacen que cada consulta
+# recorra sólo los datos de esa cohorte, por más cuatrimestres que se junten.
+#
+# Las respuestas toman la cohorte de la unidad de la pregunta (del catálogo,
+# sin consultas extra) y users.exp sólo suma la exp de la cohorte actual del
+# usuario (ver experience.py), así el ranking global de una cohorte no arrastra
+# la de cuatrimestres anteriores. `flask --app app assign-cohort <cohorte>`
+# asigna una cohorte a los datos cargados antes de que existieran.
+import re
+
+import click
+from flask import current_app, g, has_request_context, jsonify, request
+from flask.cli import with_appcontext
+
+from extensions import mongo
+from catalog import catalog
+from leaderboard import rebuild_exp_buckets
+
+COHORT_HEADER = "X-Cohort"
+ALL_COHORTS = "*"
+COHORT_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class InvalidCohort(ValueError):
+    pass
+
+
+def _parse(value):
+    value = (value or "").strip()
+    if not value or value == ALL_COHORTS:
+        return value or None
+    if not COHORT_RE.match(value):
+        raise InvalidCohort(f"cohorte inválida: {value!r}")
+    return value
+
+
+def parse_cohort(value):
+    """Valida una cohorte concreta para guardar (no "*" ni vacía); lanza InvalidCohort."""
+    cohort = _parse(value) if isinstance(value, str) else None
+    if not cohort or cohort == ALL_COHORTS:
+        raise InvalidCohort(f"cohorte inválida: {value!r}")
+    return cohort
+
+
+def request_cohort():
+    """
+    Cohorte del request actual: X-Cohort, ?cohort= o CURRENT_COHORT. Devuelve
+    None si no hay ninguna o se pidió "*" (todas); lanza InvalidCohort si el
+    valor no es válido. Fuera de un request devuelve None.
+    """
+    if not has_request_context():
+        return None
+    if "cohort" not in g:
+        value = (request.headers.get(COHORT_HEADER) or request.args.get("cohort")
+                 or current_app.config.get("CURRENT_COHORT"))
+        cohort = _parse(value)
+        g.cohort = None if cohort == ALL_COHORTS else cohort
+    return g.cohort
+
+
+def scoped(query=None, cohort=None):
+    """Copia de `query` limitada a la cohorte (la del request si no se pasa `cohort`)."""
+    query = dict(query or {})
+    cohort = cohort or request_cohort()
+    if cohort:
+        query["cohort"] = cohort
+    return query
+
+
+def cohort_of(question):
+    """Cohorte de una pregunta: la de su unidad en el catálogo (o None)."""
+    unit = catalog.unit(question.get("unit_id"))
+    return unit.get("cohort") if unit else None
+
+
+def cohort_question_ids(cohort):
+    """Ids de las preguntas de las unidades de `cohort` (con None, las de unidades sin cohorte)."""
+    return [
+        q["_id"]
+        for unit in catalog.units() if unit.get("cohort") == cohort
+        for q in catalog.questions_by_unit(unit["_id"])
+    ]
+
+
+def assign_cohort(cohort, log=None):
+    """
+    Asigna `cohort` a los usuarios, unidades y respuestas que todavía no tienen
+    cohorte. Las respuestas se asignan por la unidad de su pregunta, así que
+    sólo las de unidades de esa cohorte. Devuelve {colección: modificados}.
+    """
+    db = mongo.db
+    # sin el campo o con null (respuestas a unidades sin cohorte)
+    missing = {"cohort": None}
+    report = {}
+    for collection in ("users", "units"):
+        report[collection] = db[collection].update_many(missing, {"$set": {"cohort": cohort}}).modified_count
+    catalog.invalidate()
+
+    report["answers"] = 0
+    for unit in catalog.units(cohort):
+        question_ids = [q["_id"] for q in catalog.questions_by_unit(unit["_id"])]
+        if question_ids:
+            report["answers"] += db.answers.update_many(
+                dict(missing, question_id={"$in": question_ids}), {"$set": {"cohort": cohort}}
+            ).modified_count
+    # los usuarios asignados pasan al ranking de la cohorte (ver leaderboard.py)
+    if report["users"]:
+        rebuild_exp_buckets()
+    if log:
+        for collection, count in report.items():
+            log(f"{collection}: {count}")
+    return report
+
+
+def init_app(app):
+    """Responde 400 a los requests con una cohorte inválida."""
+    @app.errorhandler(InvalidCohort)
+    def invalid_cohort(e):
+        return jsonify({"error": str(e)}), 400
+
+
+@click.command("assign-cohort")
+@click.argument("cohort")
+@with_appcontext
+def assign_cohort_command(cohort):
+    """Asigna COHORT a los usuarios, unidades y respuestas sin cohorte."""
+    try:
+        cohort = parse_cohort(cohort)
+    except InvalidCohort as e:
+        raise click.BadParameter(str(e))
+    assign_cohort(cohort, log=click.echo)
@@ -1,97 +1,229 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from bson import ObjectId
 from extensions import mongo
+from catalog import catalog
+from pagination import parse_fields, parse_page, find_page
+from experience import compute_awarded_exp, record_exp, record_exp_many
+from grading import grade
+from json_provider import stream_json_array
+from idempotency import idempotent
+from question_stats import record_attempt, attempt_bulk_ops, mark_attempt, mark_attempts, record_answer_deleted
+from cohorts import cohort_of, scoped
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 
 answers_bp = Blueprint('answers', __name__)
 
-@answers_bp.route('/answers', methods=['POST'])
-def create_answer():
+ANSWER_FIELDS = ("question_id", "user_id", "body", "selectedOption", "correct", "cohort")
+MAX_BATCH_ANSWERS = 500
+
+def parse_answer(data):
     """
-    Crea una nueva respuesta y, si es correcta, calcula la exp neta
-    descontando penalizaciones por hints usados.
-    Se espera recibir un JSON con:
-      - question_id (string)
-      - user_id (string)
-      - body: para OpenEntry  OR  selectedOption: para Choice
+    Valida el JSON de una respuesta y arma el documento a insertar.
+    Devuelve (answer_doc, None) o (None, mensaje de error).
     """
-    data = request.get_json()
     qid = data.get("question_id")
     uid = data.get("user_id")
     body = data.get("body")
     selected = data.get("selectedOption")
 
-    # 1) Validaciones básicas
     if not qid or not uid:
-        return jsonify({"error": "Faltan question_id o user_id"}), 400
+        return None, "Faltan question_id o user_id"
     if (body is None and selected is None) or (body is not None and selected is not None):
-        return jsonify({"error": "Proporciona solo 'body' o 'selectedOption'"}), 400
+        return None, "Proporciona solo 'body' o 'selectedOption'"
 
-    # 2) Conversión a ObjectId
     try:
         q_obj = ObjectId(qid)
         u_obj = ObjectId(uid)
     except:
-        return jsonify({"error": "ID inválido"}), 400
+        return None, "ID inválido"
 
-    # 3) Inserto el registro de la respuesta
     answer_doc = {"question_id": q_obj, "user_id": u_obj}
     if body is not None:
         answer_doc["body"] = body
     else:
         answer_doc["selectedOption"] = selected
+    return answer_doc, None
+
+def first_correct_result(user_id, question_id):
+    """
+    Resultado de la primera respuesta correcta del usuario a la pregunta, para
+    devolverlo cuando el índice first_correct_unique rechaza otra (ver indexes.py).
+    """
+    original = mongo.db.answers.find_one(
+        {"user_id": user_id, "question_id": question_id, "correct": True}, {"_id": 1}
+    )
+    ledger = mongo.db.exp_ledger.find_one({"user_id": user_id, "question_id": question_id}, {"exp": 1})
+    return {
+        "answer_id": str(original["_id"]) if original else None,
+        "correct": True,
+        "expAwarded": (ledger or {}).get("exp", 0),
+        "duplicate": True
+    }
+
+@answers_bp.route('/answers', methods=['POST'])
+@idempotent("answers")
+def create_answer():
+    """
+    Crea una nueva respuesta y, si es correcta, calcula la exp neta
+    descontando penalizaciones por hints usados.
+    Se espera recibir un JSON con:
+      - question_id (string)
+      - user_id (string)
+      - body: para OpenEntry  OR  selectedOption: para Choice
+    Con el header Idempotency-Key los reintentos reciben la respuesta original
+    sin guardar nada (ver idempotency.py). Si está activo ANSWERS_FIRST_CORRECT_WINS
+    y el usuario ya había acertado la pregunta, devuelve aquel resultado con
+    "duplicate": true y no guarda la nueva respuesta.
+    """
+    data = request.get_json() or {}
 
-    ins = mongo.db.answers.insert_one(answer_doc)
+    # 1) Validaciones básicas y conversión a ObjectId
+    answer_doc, error = parse_answer(data)
+    if error:
+        return jsonify({"error": error}), 400
+    q_obj = answer_doc["question_id"]
+    u_obj = answer_doc["user_id"]
 
-    # 4) Determino si la respuesta es correcta
-    q = mongo.db.questions.find_one({"_id": q_obj})
-    is_correct = False
+    # 2) Determino si la respuesta es correcta
+    q = catalog.question(q_obj)
     if not q:
-        # (en principio no debería pasar)
+        # (en principio no debería pasar) la respuesta se guarda igual
+        mongo.db.answers.insert_one(answer_doc)
         return jsonify({"error": "Pregunta no encontrada"}), 404
 
-    if body is not None:
-        # comparación case-insensitive
-        is_correct = (body.strip().lower() == q.get("expectedAnswer", "").strip().lower())
-    else:
-        # encuentro la opción dentro de q["options"]
-        for opt in q.get("options", []):
-            if opt["body"] == selected and opt.get("isCorrect"):
-                is_correct = True
-                break
+    # selectedOption es el índice de la opción elegida (ver grading.py)
+    is_correct = bool(grade([answer_doc], {q_obj: q})[0])
+    answer_doc["correct"] = is_correct
+    # la cohorte de la respuesta es la de la unidad (ver cohorts.py)
+    answer_doc["cohort"] = cohort_of(q)
+
+    # 3) Inserto el registro de la respuesta
+    try:
+        ins = mongo.db.answers.insert_one(answer_doc)
+    except DuplicateKeyError:
+        return jsonify(first_correct_result(u_obj, q_obj)), 200
 
     exp_awarded = 0
+    # primer intento del alumno en esta pregunta (ver question_stats.py)
+    first_attempt = mark_attempt(u_obj, q_obj)
 
     if is_correct:
-        # 5) Calculo penalizaciones
-        base_exp = q.get("exp", 0)
-        help_doc = mongo.db.question_helps.find_one({
-            "user_id": u_obj,
-            "question_id": q_obj
-        }) or {}
-
-        total_penalty = 0.0
-        if help_doc.get("usedHelp1"):
-            total_penalty += q.get("hint1", {}).get("penalty", 0)
-        if help_doc.get("usedHelp2"):
-            total_penalty += q.get("hint2", {}).get("penalty", 0)
-        total_penalty = min(total_penalty, 1.0)
-
+        # 4) Ayudas usadas (para las penalizaciones)
+        help_doc = mongo.db.question_helps.find_one({"user_id": u_obj, "question_id": q_obj})
         # exp neta
-        exp_awarded = int(base_exp * (1 - total_penalty))
+        exp_awarded = compute_awarded_exp(q, help_doc)
+
+        # 5) Actualizo el libro mayor, la exp del usuario y su progreso
+        record_exp(u_obj, q, exp_awarded, answer_doc["cohort"])
 
-        # 6) Actualizo la exp del usuario
-        mongo.db.users.update_one(
-            {"_id": u_obj},
-            {"$inc": {"exp": exp_awarded}}
-        )
+    # Contadores de dificultad de la pregunta (ver question_stats.py)
+    record_attempt(q, is_correct, exp_awarded, first_attempt)
 
-    # 7) Respondo al cliente
+    # 6) Respondo al cliente
     return jsonify({
         "answer_id": str(ins.inserted_id),
         "correct": is_correct,
         "expAwarded": exp_awarded
     }), 201
 
+@answers_bp.route('/answers/batch', methods=['POST'])
+@idempotent("answers-batch")
+def create_answers_batch():
+    """
+    Crea varias respuestas de una vez (p.ej. las que un cliente sin conexión
+    guardó y reenvía). Se espera {"answers": [...]} con el mismo formato que
+    POST /answers. Todas se corrigen juntas, se insertan con un insert_many y
+    la exp se suma con una actualización por usuario. Devuelve {"results": [...]}
+    en el mismo orden: {answer_id, correct, expAwarded} o {error}. Acepta
+    Idempotency-Key como POST /answers.
+    """
+    data = request.get_json() or {}
+    items = data.get("answers")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Se espera una lista no vacía en 'answers'"}), 400
+    if len(items) > MAX_BATCH_ANSWERS:
+        return jsonify({"error": f"Máximo {MAX_BATCH_ANSWERS} respuestas por lote"}), 400
+
+    results = [None] * len(items)
+    docs = []      # respuestas válidas a insertar
+    positions = [] # índice en `items` de cada doc
+    for i, item in enumerate(items):
+        answer_doc, error = parse_answer(item if isinstance(item, dict) else {})
+        if error:
+            results[i] = {"error": error}
+        else:
+            docs.append(answer_doc)
+            positions.append(i)
+
+    # Preguntas: desde el catálogo, y las que falten con un único $in
+    questions = dict(catalog.questions())
+    missing = {d["question_id"] for d in docs} - questions.keys()
+    if missing:
+        for q in mongo.db.questions.find({"_id": {"$in": list(missing)}}):
+            questions[q["_id"]] = q
+
+    valid = [(d, p) for d, p in zip(docs, positions) if d["question_id"] in questions]
+    for d, p in zip(docs, positions):
+        if d["question_id"] not in questions:
+            results[p] = {"error": "Pregunta no encontrada"}
+    if not valid:
+        return jsonify({"results": results}), 200
+
+    docs = [d for d, _ in valid]
+    corrections = grade(docs, questions)
+    for d, ok in zip(docs, corrections):
+        d["correct"] = bool(ok)
+        d["cohort"] = cohort_of(questions[d["question_id"]])
+
+    # Ayudas usadas de todos los pares (usuario, pregunta) correctos en una consulta
+    helps = {}
+    correct_docs = [d for d in docs if d["correct"]]
+    if correct_docs:
+        for h in mongo.db.question_helps.find({
+            "user_id": {"$in": list({d["user_id"] for d in correct_docs})},
+            "question_id": {"$in": list({d["question_id"] for d in correct_docs})}
+        }):
+            helps[(h["user_id"], h["question_id"])] = h
+
+    # ordered=False: con ANSWERS_FIRST_CORRECT_WINS las correctas repetidas
+    # se rechazan una por una sin frenar al resto (insert_many ya les asignó _id)
+    duplicates = set()
+    try:
+        mongo.db.answers.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            if err.get("code") != 11000:
+                raise
+            duplicates.add(err["index"])
+
+    # primeros intentos de los pares insertados (un par puede repetirse en el lote)
+    inserted = [(i, d) for i, (d, _) in enumerate(valid) if i not in duplicates]
+    first_pairs = mark_attempts(list(dict.fromkeys((d["user_id"], d["question_id"]) for _, d in inserted)))
+
+    awards = []
+    attempts = []
+    for i, d in inserted:
+        p = valid[i][1]
+        ok = corrections[i]
+        exp_awarded = 0
+        q = questions[d["question_id"]]
+        pair = (d["user_id"], d["question_id"])
+        if ok:
+            exp_awarded = compute_awarded_exp(q, helps.get(pair))
+            awards.append((d["user_id"], q, exp_awarded))
+        first_attempt = pair in first_pairs
+        first_pairs.discard(pair)
+        attempts.append((q, ok, exp_awarded, first_attempt))
+        results[p] = {"answer_id": str(d["_id"]), "correct": bool(ok), "expAwarded": exp_awarded}
+
+    record_exp_many(awards)
+    if attempts:
+        mongo.db.question_stats.bulk_write(attempt_bulk_ops(attempts), ordered=False)
+    for i in duplicates:
+        d, p = valid[i]
+        results[p] = first_correct_result(d["user_id"], d["question_id"])
+    return jsonify({"results": results}), 200
+
 @answers_bp.route('/answers', methods=['GET'])
 def get_answers():
     """
@@ -99,8 +231,11 @@ def get_answers():
     Se pueden filtrar opcionalmente por:
       - question_id: mediante un parámetro de consulta.
       - user_id: mediante un parámetro de consulta.
+    Además acepta `fields` (campos a devolver) y `limit`/`after` para paginar
+    (ver pagination.py). Sólo devuelve las respuestas de la cohorte del
+    request (ver cohorts.py).
     """
-    query = {}
+    query = scoped()
     question_id = request.args.get("question_id")
     user_id = request.args.get("user_id")
 
@@ -116,14 +251,18 @@ def get_answers():
         except Exception:
             return jsonify({"error": "user_id inválido"}), 400
 
-    cursor = mongo.db.answers.find(query)
-    answers = []
-    for ans in cursor:
-        ans["_id"] = str(ans["_id"])
-        ans["question_id"] = str(ans["question_id"])
-        ans["user_id"] = str(ans["user_id"])
-        answers.append(ans)
-    return jsonify(answers), 200
+    try:
+        projection = parse_fields(request.args.get("fields"), ANSWER_FIELDS)
+        limit, after = parse_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Los ObjectId los serializa el proveedor JSON (ver json_provider.py)
+    if limit:
+        answers, next_token = find_page(mongo.db.answers, query, projection, limit, after)
+        return jsonify({"items": answers, "next": next_token}), 200
+    cursor = mongo.db.answers.find(query, projection)
+    return Response(stream_json_array(cursor), mimetype="application/json"), 200
 
 @answers_bp.route('/answers/<answer_id>', methods=['GET'])
 def get_answer(answer_id):
@@ -139,9 +278,6 @@ def get_answer(answer_id):
     if not answer:
         return jsonify({"error": "Respuesta no encontrada"}), 404
 
-    answer["_id"] = str(answer["_id"])
-    answer["question_id"] = str(answer["question_id"])
-    answer["user_id"] = str(answer["user_id"])
     return jsonify(answer), 200
 
 @answers_bp.route('/answers/<answer_id>', methods=['DELETE'])
@@ -154,7 +290,8 @@ def delete_answer(answer_id):
     except Exception:
         return jsonify({"error": "answer_id inválido"}), 400
 
-    result = mongo.db.answers.delete_one({"_id": ans_id})
-    if result.deleted_count == 0:
+    answer = mongo.db.answers.find_one_and_delete({"_id": ans_id}, projection={"question_id": 1, "correct": 1})
+    if answer is None:
         return jsonify({"error": "Respuesta no encontrada"}), 404
+    record_answer_deleted(answer)
     return jsonify({"message": "Respuesta eliminada exitosamente"}), 200
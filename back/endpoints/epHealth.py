@@ -0,0 +1,31 @@
+# Endpoints de salud para el balanceador / orquestador:
+# - /health/live: el proceso responde.
+# - /health/ready: MongoDB responde y el pool de conexiones no está saturado.
+from flask import Blueprint, jsonify, current_app
+from extensions import mongo
+from monitoring import pool_monitor
+
+health_bp = Blueprint('health', __name__, url_prefix='/health')
+
+@health_bp.route('/live', methods=['GET'])
+def live():
+    return jsonify({"status": "ok"}), 200
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    pool = pool_monitor.stats()
+    try:
+        mongo.db.command("ping")
+        mongo_ok = True
+    except Exception as e:
+        current_app.logger.warning("MongoDB no responde: %s", e)
+        mongo_ok = False
+
+    max_saturation = current_app.config.get("READY_MAX_POOL_SATURATION", 1.0)
+    saturated = pool["saturation"] is not None and pool["saturation"] >= max_saturation
+    ready = mongo_ok and not saturated
+    return jsonify({
+        "status": "ok" if ready else "unavailable",
+        "mongo": mongo_ok,
+        "pool": pool
+    }), 200 if ready else 503
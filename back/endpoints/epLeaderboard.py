@@ -0,0 +1,90 @@
+# Rankings de exp (ver leaderboard.py): top-K global o de una unidad, y la
+# posición del usuario logueado con sus vecinos y su percentil.
+from flask import Blueprint, request, jsonify
+from bson import ObjectId
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import mongo
+from leaderboard import global_board, unit_board, with_names
+from cohorts import request_cohort
+
+leaderboard_bp = Blueprint('leaderboard', __name__)
+
+MAX_TOP = 100
+MAX_NEIGHBOURS = 25
+
+
+def _board_from_args():
+    """
+    Devuelve (board, None) según ?unit_id= o (None, mensaje de error). Sin
+    unit_id, el ranking global de la cohorte del request (ver cohorts.py).
+    """
+    unit_id = request.args.get('unit_id')
+    if not unit_id:
+        return global_board(request_cohort()), None
+    try:
+        return unit_board(ObjectId(unit_id)), None
+    except Exception:
+        return None, "unit_id inválido"
+
+
+def _int_arg(name, default, maximum):
+    value = int(request.args.get(name, default))
+    if value < 1 or value > maximum:
+        raise ValueError(f"{name} debe estar entre 1 y {maximum}")
+    return value
+
+
+@leaderboard_bp.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """
+    Los `limit` (por defecto 10) usuarios con más exp, global o de la unidad
+    `unit_id`: [{rank, user_id, name, lastname, exp}, ...].
+    """
+    board, error = _board_from_args()
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        limit = _int_arg('limit', 10, MAX_TOP)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(with_names(board.top(limit))), 200
+
+
+@leaderboard_bp.route('/leaderboard/me', methods=['GET'])
+@jwt_required()
+def get_my_rank():
+    """
+    Posición del usuario logueado (global o en la unidad `unit_id`), el
+    porcentaje de usuarios con menos exp (percentile) y los `neighbours`
+    (por defecto 5) usuarios inmediatamente por encima y por debajo.
+    """
+    board, error = _board_from_args()
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        neighbours = _int_arg('neighbours', 5, MAX_NEIGHBOURS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user = mongo.db.users.find_one({"DNI": get_jwt_identity()}, {"_id": 1})
+    if not user:
+        return jsonify({"error": "Usuario no encontrado"}), 404
+
+    entry = board.entry(user["_id"])
+    total = board.total()
+    if not entry:
+        # todavía no sumó exp en esa unidad
+        return jsonify({"rank": None, "exp": 0, "total": total, "percentile": None, "above": [], "below": []}), 200
+
+    exp = entry.get("exp", 0)
+    rank, below_count, above, below = board.around(user["_id"], exp, neighbours)
+    rows = with_names(above + below)
+    return jsonify({
+        "rank": rank,
+        "exp": exp,
+        "total": total,
+        "percentile": round(below_count / total * 100, 1) if total else None,
+        "above": rows[:len(above)],
+        "below": rows[len(above):]
+    }), 200
@@ -7,7 +7,14 @@ from flask_cors import CORS, cross_origin
 from werkzeug.utils import secure_filename
 from bson import ObjectId
 from extensions import mongo
+from catalog import catalog
+from http_cache import catalog_cached
+from pagination import parse_fields, parse_page, find_page
 from datetime import datetime
+from images import store_image, pick_variant, InvalidImage
+from cleanup import cascade_delete_questions
+from question_stats import record_help, question_stats, mark_attempt
+from cohorts import request_cohort, cohort_of
 
 questions_bp = Blueprint('questions', __name__)
 # Habilita CORS y OPTIONS en todas las rutas de este blueprint 
@@ -17,6 +24,8 @@ CORS(questions_bp, resources={r"/questions/*": {"origins": "*"}})
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'img')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+QUESTION_FIELDS = ("type", "body", "exp", "unit_id", "options", "expectedAnswer",
+                   "acceptedAnswers", "tolerance", "imagePath", "hint1", "hint2", "version")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -56,6 +65,12 @@ def create_question():
         if "expectedAnswer" not in data:
             return jsonify({"error": "Falta la respuesta esperada para pregunta tipo OpenEntry"}), 400
         question["expectedAnswer"] = data["expectedAnswer"]
+        # Alias aceptados y margen para respuestas numéricas (ver grading.py)
+        for f in ("acceptedAnswers", "tolerance"):
+            if f in data:
+                if not validate_grading_field(f, data[f]):
+                    return jsonify({"error": f"{f} inválido"}), 400
+                question[f] = data[f]
     else:
         return jsonify({"error": "Tipo de pregunta no válido"}), 400
 
@@ -73,10 +88,12 @@ def create_question():
 
 
     res = mongo.db.questions.insert_one(question)
+    catalog.invalidate()
     return jsonify({"message": "Pregunta creada", "question_id": str(res.inserted_id)}), 201
 
 @questions_bp.route('/questions', methods=['GET'])
 @cross_origin()
+@catalog_cached
 def get_questions():
     query = {}
     uid = request.args.get('unit_id')
@@ -85,16 +102,25 @@ def get_questions():
             query['unit_id'] = ObjectId(uid)
         except:
             return jsonify({"error":"unit_id inválido"}), 400
-    out = []
-    for q in mongo.db.questions.find(query):
-        q['_id'], q['unit_id'] = str(q['_id']), str(q['unit_id'])
-        if "imagePath" in q:
-            q['imagePath'] = q['imagePath']
-        out.append(q)
-    return jsonify(out), 200
+    else:
+        # sin unit_id, las preguntas de las unidades de la cohorte (ver cohorts.py)
+        cohort = request_cohort()
+        if cohort:
+            query['unit_id'] = {"$in": [u["_id"] for u in catalog.units(cohort)]}
+    try:
+        projection = parse_fields(request.args.get('fields'), QUESTION_FIELDS)
+        limit, after = parse_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if limit:
+        out, next_token = find_page(mongo.db.questions, query, projection, limit, after)
+        return jsonify({"items": out, "next": next_token}), 200
+    return jsonify(list(mongo.db.questions.find(query, projection))), 200
 
 @questions_bp.route('/questions/<question_id>', methods=['GET'])
 @cross_origin()
+@catalog_cached
 def get_question(question_id):
     try:
         q_id = ObjectId(question_id)
@@ -103,9 +129,6 @@ def get_question(question_id):
     q = mongo.db.questions.find_one({"_id": q_id})
     if not q:
         return jsonify({"error":"Pregunta no encontrada"}), 404
-    q['_id'], q['unit_id'] = str(q['_id']), str(q['unit_id'])
-    if "imagePath" in q:
-        q['imagePath'] = q['imagePath']
     return jsonify(q), 200
 
 @questions_bp.route('/questions/<question_id>', methods=['PUT'])
@@ -122,6 +145,11 @@ def update_question(question_id):
     for f in ("type","body","exp","expectedAnswer","options","imagePath"):
         if f in data:
             updates[f] = data[f]
+    for f in ("acceptedAnswers", "tolerance"):
+        if f in data:
+            if not validate_grading_field(f, data[f]):
+                return jsonify({"error": f"{f} inválido"}), 400
+            updates[f] = data[f]
 
     # actualizar hints si vienen
     for i in (1,2):
@@ -145,9 +173,11 @@ def update_question(question_id):
     if not updates:
         return jsonify({"error":"Nada que actualizar"}), 400
 
-    res = mongo.db.questions.update_one({"_id":q_id}, {"$set":updates})
+    # version invalida el corrector compilado de la pregunta (grading.py)
+    res = mongo.db.questions.update_one({"_id":q_id}, {"$set":updates, "$inc": {"version": 1}})
     if res.matched_count == 0:
         return jsonify({"error":"Pregunta no encontrada"}), 404
+    catalog.invalidate()
     return jsonify({"message":"Actualizada exitosamente"}), 200
 
 @questions_bp.route('/questions/<question_id>', methods=['DELETE'])
@@ -157,9 +187,14 @@ def delete_question(question_id):
         q_id = ObjectId(question_id)
     except:
         return jsonify({"error":"question_id inválido"}), 400
-    res = mongo.db.questions.delete_one({"_id":q_id})
-    if res.deleted_count == 0:
+    q = mongo.db.questions.find_one_and_delete({"_id":q_id}, {"unit_id": 1})
+    if not q:
         return jsonify({"error":"Pregunta no encontrada"}), 404
+    # la cohorte sale de la unidad en el catálogo, antes de invalidarlo
+    cohorts = {q_id: cohort_of(q)}
+    catalog.invalidate()
+    # Respuestas, ayudas y la exp que otorgó (ver cleanup.py)
+    cascade_delete_questions([q], cohorts)
     return jsonify({"message":"Eliminada exitosamente"}), 200
 
 @questions_bp.route('/questions/<id>/image', methods=['POST','OPTIONS'])
@@ -176,21 +211,39 @@ def upload_question_image(id):
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({"error":"Archivo no válido"}), 400
 
-    filename = secure_filename(file.filename)  # sanitiza nombre :contentReference[oaicite:5]{index=5}
-    file.save(os.path.join(UPLOAD_FOLDER, filename))
+    # Se guarda con el hash del contenido como nombre y con sus variantes (ver images.py)
+    # la extensión del archivo guardado sale del contenido, no del nombre
+    try:
+        filename = store_image(file.read(), UPLOAD_FOLDER)
+    except (InvalidImage, OSError):
+        return jsonify({"error":"Archivo no válido"}), 400
 
     mongo.db.questions.update_one(
         {"_id": ObjectId(id)},
         {"$set": {"imagePath": filename}}
     )
+    catalog.invalidate()
 
-    public_url = url_for('static', filename=f'../img/{filename}', _external=True)
+    public_url = url_for('questions.serve_question_image', filename=filename, _external=True)
     return jsonify({"imageUrl": public_url}), 200
 @questions_bp.route("/back/img/<filename>")
 def serve_question_image(filename):
+    """
+    Sirve una imagen de pregunta. Con `?w=<ancho>` elige la variante más chica
+    que alcance y, si el navegador acepta WebP, la versión WebP. Las imágenes
+    con nombre hasheado se marcan como inmutables. Soporta Range.
+    """
     # Ruta absoluta al directorio donde están las imágenes
     image_dir = os.path.join(current_app.root_path, "img")
-    return send_from_directory(image_dir, filename)
+    width = request.args.get("w", type=int)
+    accepts_webp = "image/webp" in request.accept_mimetypes.values()
+    name, immutable = pick_variant(filename, image_dir, width, accepts_webp)
+
+    resp = send_from_directory(image_dir, name, conditional=True)
+    resp.vary.add("Accept")
+    if immutable:
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
 
 
 def validate_hint(h):
@@ -202,6 +255,12 @@ def validate_hint(h):
         and 0 <= h["penalty"] <= 1
     )
 
+def validate_grading_field(field, value):
+    """acceptedAnswers: lista de strings; tolerance: número >= 0 (o None para quitarlo)."""
+    if field == "acceptedAnswers":
+        return isinstance(value, list) and all(isinstance(a, str) for a in value)
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0)
+
 @questions_bp.route('/questions/<question_id>/help', methods=['POST'])
 def use_help(question_id):
     data = request.get_json()
@@ -209,22 +268,42 @@ def use_help(question_id):
     h = data["helpNumber"]     # 1 o 2
 
     hint_key = f"hint{h}"
-    q = mongo.db.questions.find_one({"_id": ObjectId(question_id)})
+    q = catalog.question(ObjectId(question_id))
     if not q or hint_key not in q:
         return jsonify({"error":"No existe esa ayuda"}), 400
 
     # Registra el uso (upsert)
-    mongo.db.question_helps.update_one(
+    before = mongo.db.question_helps.find_one_and_update(
         {"user_id":u_id, "question_id":q["_id"]},
         {"$set": {f"usedHelp{h}": True, "timestamp": datetime.utcnow()}},
         upsert=True
     )
+    # sólo la primera vez que el usuario pide esta ayuda cuenta para las estadísticas
+    # (y cuenta al alumno en `users` si es su primer contacto con la pregunta)
+    if not (before or {}).get(f"usedHelp{h}"):
+        record_help(q, h, mark_attempt(u_id, q["_id"]))
 
     return jsonify({
       "text": q[hint_key]["text"],
       "penalty": q[hint_key]["penalty"]
     }), 200
 
+@questions_bp.route('/questions/<question_id>/stats', methods=['GET'])
+@cross_origin()
+def get_question_stats(question_id):
+    """
+    Dificultad de la pregunta: intentos, aciertos, tasa de acierto, uso de
+    cada ayuda (alumnos que la pidieron sobre alumnos que la intentaron) y exp
+    promedio por acierto.
+    """
+    try:
+        q_id = ObjectId(question_id)
+    except:
+        return jsonify({"error":"question_id inválido"}), 400
+    if not catalog.question(q_id):
+        return jsonify({"error":"Pregunta no encontrada"}), 404
+    return jsonify(question_stats(q_id)), 200
+
 @questions_bp.route('/questions/<question_id>/help-status', methods=['GET'])
 @cross_origin()
 def get_help_status(question_id):
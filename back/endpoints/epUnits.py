@@ -4,17 +4,32 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
 from extensions import mongo
+from catalog import catalog
+from http_cache import catalog_cached
+from pagination import parse_fields, parse_page, find_page
+from cleanup import cascade_delete_unit
+from question_stats import unit_stats
+from cohorts import request_cohort, scoped
 
 units_bp = Blueprint('units', __name__)
 
+UNIT_FIELDS = ("title", "level", "cohort")
+
 @units_bp.route('/units', methods=['GET'])
+@catalog_cached
 def get_units():
-    units_cursor = mongo.db.units.find()
-    units_list = []
-    for unit in units_cursor:
-        unit['_id'] = str(unit['_id'])
-        units_list.append(unit)
-    return jsonify(units_list), 200
+    try:
+        projection = parse_fields(request.args.get("fields"), UNIT_FIELDS)
+        limit, after = parse_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # sólo las unidades de la cohorte del request (ver cohorts.py)
+    query = scoped()
+    if limit:
+        units_list, next_token = find_page(mongo.db.units, query, projection, limit, after)
+        return jsonify({"items": units_list, "next": next_token}), 200
+    return jsonify(list(mongo.db.units.find(query, projection))), 200
 
 @units_bp.route('/units', methods=['POST'])
 def create_unit():
@@ -25,10 +40,15 @@ def create_unit():
     if not title or level is None:
         return jsonify({"error": "Faltan datos"}), 400
 
-    result = mongo.db.units.insert_one({
+    unit = {
         "title": title,
         "level": level
-    })
+    }
+    cohort = request_cohort()
+    if cohort:
+        unit["cohort"] = cohort
+    result = mongo.db.units.insert_one(unit)
+    catalog.invalidate()
 
     return jsonify({
         "message": "Unidad creada exitosamente",
@@ -55,18 +75,24 @@ def update_unit(unit_id):
 
     if result.matched_count == 0:
         return jsonify({"error": "Unidad no encontrada"}), 404
+    catalog.invalidate()
 
     return jsonify({"message": "Unidad actualizada exitosamente"}), 200
 
 @units_bp.route('/units/<unit_id>', methods=['DELETE'])
 def delete_unit(unit_id):
-    result = mongo.db.units.delete_one({"_id": ObjectId(unit_id)})
+    unit = mongo.db.units.find_one_and_delete({"_id": ObjectId(unit_id)}, {"cohort": 1})
     
-    if result.deleted_count == 0:
+    if unit is None:
         return jsonify({"error": "Unidad no encontrada"}), 404
+    # Sus preguntas, con sus respuestas, ayudas y exp (ver cleanup.py); la
+    # cohorte se pasa porque el catálogo ya no va a tener la unidad
+    cascade_delete_unit(unit["_id"], unit.get("cohort"))
+    catalog.invalidate()
 
     return jsonify({"message": "Unidad eliminada exitosamente"}), 200
 @units_bp.route('/units/<unit_id>', methods=['GET'])
+@catalog_cached
 def get_unit_by_id(unit_id):
     try:
         obj_id = ObjectId(unit_id)
@@ -77,6 +103,20 @@ def get_unit_by_id(unit_id):
     if not unit:
         return jsonify({"error": "Unidad no encontrada"}), 404
 
-    # convertir ObjectId a string
-    unit['_id'] = str(unit['_id'])
-    return jsonify(unit), 200
\ No newline at end of file
+    return jsonify(unit), 200
+
+@units_bp.route('/units/<unit_id>/stats', methods=['GET'])
+def get_unit_stats(unit_id):
+    """
+    Dificultad de la unidad: totales de sus preguntas y las estadísticas de
+    cada una, de la más difícil a la más fácil (ver question_stats.py).
+    """
+    try:
+        obj_id = ObjectId(unit_id)
+    except Exception:
+        return jsonify({"error": "ID inválido"}), 400
+
+    if not catalog.unit(obj_id):
+        return jsonify({"error": "Unidad no encontrada"}), 404
+
+    return jsonify(unit_stats(obj_id)), 200
\ No newline at end of file
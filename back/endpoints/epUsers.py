@@ -1,84 +1,102 @@
-import io, csv
-from flask import Blueprint, request, jsonify,current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+import io, shutil, tempfile
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
 from extensions import mongo
+from pagination import parse_fields, parse_page, encode_cursor
+from experience import users_exp_pipeline, cohort_exp
+from progress import progress_pipeline, summarize
+from cleanup import cascade_delete_user
+from leaderboard import move_buckets, user_boards, user_moves
+from cohorts import request_cohort, scoped, parse_cohort
 from utils import generate_random_password
-from flask_mail import Mail, Message
+from passwords import hash_password, check_password, HashingBusy
+from importer import import_users, start_import_job
+from flask_mail import Message
+from outbox import enqueue_mail
 from bson import ObjectId
 from werkzeug.utils import secure_filename
 
-mail=Mail()
-
 users_bp = Blueprint('users', __name__)
 
+USERS_SORT_FIELDS = ("exp", "DNI", "name", "lastname")
+# campos que puede devolver /users (nunca el hash de la contraseña)
+USER_FIELDS = ("DNI", "name", "lastname", "email", "role", "exp", "cohort")
+
+
+@users_bp.errorhandler(HashingBusy)
+def hashing_busy(_e):
+    # El pool de hasheo está saturado: pedimos al cliente que reintente
+    return jsonify({"error": "Servidor ocupado, reintentá en unos segundos"}), 503, {"Retry-After": "2"}
+
 
 
 @users_bp.route('/users', methods=['GET'])
 ##@jwt_required()
 def get_users():
-    users = mongo.db.users.find()
-    all_users_data = []
-    # Precargo todas las preguntas en un dict
-    questions = {q["_id"]: q for q in mongo.db.questions.find()}
+    """
+    Lista los usuarios con su exp.
+    Parámetros opcionales de consulta:
+      - mode=aggregate: recalcula la exp en MongoDB con una sola agregación
+        (respuestas, preguntas y ayudas) en lugar de leer users.exp.
+      - fields: campos a devolver (DNI, name, lastname, email, role, exp, cohort).
+      - limit / after: paginado por cursor (ver pagination.py); responde
+        {"items": [...], "next": token}.
+      - sort: campo de orden (exp, DNI, name, lastname); con '-' delante es
+        descendente. Con sort se pagina con skip en lugar de after.
+    Sólo lista los usuarios de la cohorte del request (ver cohorts.py).
+    """
+    sort = request.args.get("sort", "")
+    sort_field = sort.lstrip("-") or None
+    if sort_field and sort_field not in USERS_SORT_FIELDS:
+        return jsonify({"error": "sort inválido"}), 400
+    try:
+        projection = parse_fields(request.args.get("fields"), USER_FIELDS)
+        limit, after = parse_page(request.args)
+        skip = int(request.args.get("skip", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if skip < 0:
+        return jsonify({"error": "skip debe ser un entero positivo"}), 400
+    if after is not None and (sort_field or skip):
+        return jsonify({"error": "after no se puede combinar con sort ni skip"}), 400
+    descending = sort.startswith("-")
+    fields = list(projection) if projection else list(USER_FIELDS)
+
+    # Sin sort, las páginas van por _id (keyset); pedimos uno de más para saber si hay otra
+    keyset = limit is not None and not sort_field
+    fetch = limit + 1 if keyset else limit
+    cohort = request_cohort()
+
+    if request.args.get("mode") == "aggregate":
+        # Una única ida y vuelta a MongoDB: el servidor calcula, ordena y pagina
+        users = mongo.db.users.aggregate(
+            users_exp_pipeline("_id" if keyset else sort_field, descending, skip, fetch, after, cohort),
+            allowDiskUse=True
+        )
+    else:
+        # La exp de cada usuario se mantiene en users.exp (ver experience.py),
+        # así que no hace falta recorrer respuestas ni ayudas.
+        query = scoped({"_id": {"$gt": after}} if after is not None else {}, cohort)
+        users = mongo.db.users.find(query, {f: 1 for f in fields}).skip(skip).limit(fetch or 0)
+        if keyset:
+            users = users.sort("_id", 1)
+        elif sort_field:
+            users = users.sort([(sort_field, -1 if descending else 1), ("_id", 1)])
 
+    all_users_data = []
     for user in users:
-        totalExp = 0
-        # Obtengo todas las respuestas de este usuario
-        answers = mongo.db.answers.find({"user_id": user["_id"]})
-
-        for ans in answers:
-            q = questions.get(ans["question_id"])
-            if not q:
-                continue
-
-            # 1) Verifico si la respuesta es correcta
-            is_correct = False
-            if "selectedOption" in ans:
-                try:
-                    idx = int(ans["selectedOption"])
-                    opts = q.get("options", [])
-                    if 0 <= idx < len(opts) and opts[idx].get("isCorrect"):
-                        is_correct = True
-                except (ValueError, IndexError):
-                    continue
-            elif "body" in ans:
-                if validate_open_entry_answer(q, ans["body"]):
-                    is_correct = True
-
-            if not is_correct:
-                continue
-
-            # 2) Consulto si usó hints para esta pregunta
-            help_doc = mongo.db.question_helps.find_one({
-                "user_id": user["_id"],
-                "question_id": q["_id"]
-            }) or {}
-
-            # 3) Sumo penalizaciones
-            total_penalty = 0.0
-            if help_doc.get("usedHelp1"):
-                total_penalty += q.get("hint1", {}).get("penalty", 0)
-            if help_doc.get("usedHelp2"):
-                total_penalty += q.get("hint2", {}).get("penalty", 0)
-            total_penalty = min(total_penalty, 1.0)
-
-            # 4) Calculo experiencia neta y acumulo
-            base_exp = q.get("exp", 0)
-            awarded = int(base_exp * (1 - total_penalty))
-            totalExp += awarded
-
-        all_users_data.append({
-            "user_id": str(user["_id"]),
-            "DNI": user.get("DNI"),
-            "name": user.get("name"),
-            "lastname": user.get("lastname"),
-            "email": user.get("email"),
-            "role": user.get("role"),
-            "exp": totalExp
-        })
-
-    return jsonify(all_users_data), 200
+        row = {"user_id": str(user["_id"])}
+        for f in fields:
+            row[f] = user.get(f, 0) if f == "exp" else user.get(f)
+        all_users_data.append(row)
+
+    if limit is None:
+        return jsonify(all_users_data), 200
+    next_token = None
+    if keyset and len(all_users_data) > limit:
+        all_users_data = all_users_data[:limit]
+        next_token = encode_cursor(ObjectId(all_users_data[-1]["user_id"]))
+    return jsonify({"items": all_users_data, "next": next_token}), 200
 
 @users_bp.route('/register', methods=['POST'])
 def register():
@@ -92,18 +110,25 @@ def register():
     if not username or not password:
         return jsonify({"error": "Faltan datos"}), 400
 
-    if mongo.db.users.find_one({"username": username}):
+    if mongo.db.users.find_one({"DNI": username}):
         return jsonify({"error": "El usuario ya existe"}), 409
 
-    hashed_password = generate_password_hash(password)
-    mongo.db.users.insert_one({
+    hashed_password = hash_password(password)
+    user = {
         "DNI": username,
         "name": name,
         "lastname": lastname,
         "email": email,
         "password": hashed_password,
-        "role": "user" 
-    })
+        "role": "user",
+        "exp": 0
+    }
+    cohort = request_cohort()
+    if cohort:
+        user["cohort"] = cohort
+    mongo.db.users.insert_one(user)
+    # entra a los rankings con 0 de exp (ver leaderboard.py)
+    move_buckets([(user_boards(cohort), None, 0)])
 
     msg = Message("Credenciales para el taller de resolución de problemas", recipients=[email])
     text_body = f"Hola {name},\n\nTu DNI para iniciar sesión es: {username}\n\nTu contraseña para iniciar sesión es: {password}\n\n¡Saludos!"
@@ -116,7 +141,7 @@ def register():
     """
     msg.body = text_body
     msg.html = html_body
-    current_app.extensions['mail'].send(msg)
+    enqueue_mail(msg)
 
     return jsonify({"message": "Usuario registrado exitosamente. Se ha enviado un correo con la contraseña."}), 201
 
@@ -128,7 +153,7 @@ def login():
     
     user = mongo.db.users.find_one({"DNI": username})
     
-    if user and check_password_hash(user["password"], password):
+    if user and check_password(user["password"], password):
         access_token = create_access_token(identity=username)
         return jsonify({"access_token": access_token}), 200
     else:
@@ -142,51 +167,6 @@ def get_profile():
     if not user:
         return jsonify({"error": "Usuario no encontrado"}), 404
 
-    totalExp = 0
-    # Precargo preguntas
-    questions = {q["_id"]: q for q in mongo.db.questions.find()}
-    answers = mongo.db.answers.find({"user_id": user["_id"]})
-
-    for ans in answers:
-        q = questions.get(ans["question_id"])
-        if not q:
-            continue
-
-        # 1) Verifico corrección
-        is_correct = False
-        if "selectedOption" in ans:
-            try:
-                idx = int(ans["selectedOption"])
-                opts = q.get("options", [])
-                if 0 <= idx < len(opts) and opts[idx].get("isCorrect"):
-                    is_correct = True
-            except (ValueError, IndexError):
-                continue
-        elif "body" in ans:
-            if validate_open_entry_answer(q, ans["body"]):
-                is_correct = True
-
-        if not is_correct:
-            continue
-
-        # 2) Penalizaciones por hints
-        help_doc = mongo.db.question_helps.find_one({
-            "user_id": user["_id"],
-            "question_id": q["_id"]
-        }) or {}
-
-        total_penalty = 0.0
-        if help_doc.get("usedHelp1"):
-            total_penalty += q.get("hint1", {}).get("penalty", 0)
-        if help_doc.get("usedHelp2"):
-            total_penalty += q.get("hint2", {}).get("penalty", 0)
-        total_penalty = min(total_penalty, 1.0)
-
-        # 3) Experiencia neta
-        base_exp = q.get("exp", 0)
-        awarded = int(base_exp * (1 - total_penalty))
-        totalExp += awarded
-
     profile = {
         "userId": str(user["_id"]),
         "DNI": user["DNI"],
@@ -194,7 +174,8 @@ def get_profile():
         "lastname": user["lastname"],
         "email": user["email"],
         "role": user.get("role", ""),
-        "exp": totalExp,
+        "exp": user.get("exp", 0),
+        "cohort": user.get("cohort"),
     }
     return jsonify(profile), 200
 
@@ -219,14 +200,13 @@ def update_profile():
         return jsonify({"error": "Usuario no encontrado"}), 404
 
     # Verificar si la contraseña actual es correcta.
-    # Por ejemplo, suponiendo que usás check_password_hash
-    if not check_password_hash(user.get("password", ""), current_password):
+    if not check_password(user.get("password", ""), current_password):
         return jsonify({"error": "Contraseña actual incorrecta"}), 401
 
     # Si la contraseña es correcta, actualizamos la contraseña (hasheada)
     mongo.db.users.update_one(
         {"DNI": current_dni},
-        {"$set": {"password": generate_password_hash(new_password)}}
+        {"$set": {"password": hash_password(new_password)}}
     )
 
     # Si la contraseña fue actualizada, enviar un correo de notificación
@@ -251,78 +231,38 @@ def update_profile():
             """
             msg.body = text_body
             msg.html = html_body
-            current_app.extensions['mail'].send(msg)
+            enqueue_mail(msg)
 
     return jsonify({"message": "Usuario actualizado exitosamente"}), 200
-def validate_open_entry_answer(question, user_answer):
-    # Validar la respuesta abierta
-    correct_answer = question.get("expectedAnswer", "").strip().lower()
-    user_answer = user_answer.strip().lower()
-    print(f"Validando respuesta abierta: '{user_answer}' == '{correct_answer}'")  # Depuración
-    return user_answer == correct_answer
-
 @users_bp.route('/user-progress', methods=['GET'])
 @jwt_required()
 def get_user_progress():
+    """
+    Preguntas resueltas por unidad: {unit_id: [question_id, ...]}.
+    Con detail=1 devuelve {unit_id: {"solved": [...], "total": n, "ratio": r}}.
+    Lee el progreso materializado (ver progress.py) junto con el usuario en una
+    sola consulta.
+    """
     current_dni = get_jwt_identity()
-    user = mongo.db.users.find_one({"DNI": current_dni})
+    user = next(mongo.db.users.aggregate(progress_pipeline(current_dni)), None)
 
     if not user:
         return jsonify({"error": "Usuario no encontrado"}), 404
 
-    user_id = user["_id"]
-
-    # Obtener todas las respuestas del usuario
-    answers = mongo.db.answers.find({"user_id": user_id})
-
-    # Cargar todas las preguntas en un diccionario para acceso rápido
-    questions = {q["_id"]: q for q in mongo.db.questions.find()}
-
-    # Inicializar un diccionario para almacenar el progreso por unidad
-    progress_by_unit = {}
-
-    for answer in answers:
-        question_id = answer.get("question_id")
-        question = questions.get(question_id)
-
-        if not question:
-            continue
-
-        unit_id = str(question.get("unit_id"))
-
-        # Verificar si la respuesta es correcta
-        is_correct = False
-        if "selectedOption" in answer:
-            try:
-                idx = int(answer["selectedOption"])
-                options = question.get("options", [])
-                if 0 <= idx < len(options):
-                    selected_option = options[idx]
-                    is_correct = selected_option.get("isCorrect", False)
-            except (ValueError, IndexError):
-                continue
-        elif "body" in answer:
-            correct_answer = question.get("expectedAnswer", "").strip().lower()
-            user_answer = answer["body"].strip().lower()
-            is_correct = user_answer == correct_answer
-
-        if is_correct:
-            if unit_id not in progress_by_unit:
-                progress_by_unit[unit_id] = []
-            progress_by_unit[unit_id].append(str(question_id))
-
-    return jsonify(progress_by_unit), 200
+    detail = request.args.get("detail") in ("1", "true")
+    return jsonify(summarize(user["units"], detail)), 200
 
 @users_bp.route('/users/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        result = mongo.db.users.delete_one({"_id": ObjectId(user_id)})
+        user = mongo.db.users.find_one_and_delete({"_id": ObjectId(user_id)}, {"exp": 1, "cohort": 1})
 
-        if result.deleted_count == 0:
+        if user is None:
             return jsonify({"error": "Usuario no encontrado"}), 404
+        move_buckets(user_moves(user))
 
-        # Eliminar también las respuestas asociadas a ese usuario, si aplica
-        mongo.db.answers.delete_many({"user_id": ObjectId(user_id)})
+        # Eliminar también sus respuestas, ayudas, exp y progreso (ver cleanup.py)
+        cascade_delete_user(ObjectId(user_id))
 
         return jsonify({"message": "Usuario eliminado exitosamente"}), 200
 
@@ -331,9 +271,8 @@ def delete_user(user_id):
 @users_bp.route('/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     try:
-        user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
+        user = mongo.db.users.find_one({"_id": ObjectId(user_id)}, {"password": 0})
         if user:
-            user['_id'] = str(user['_id'])  # Convertir ObjectId a string
             return jsonify(user), 200
         else:
             return jsonify({"error": "Usuario no encontrado"}), 404
@@ -360,19 +299,28 @@ def update_user(id):
         return jsonify({"error": "Usuario no encontrado"}), 404
 
     # Campos permitidos a actualizar y comparación
-    updatable_fields = ["DNI", "name", "lastname", "email", "role"]
+    # cohort: p.ej. un alumno que recursa pasa a la cohorte nueva
+    updatable_fields = ["DNI", "name", "lastname", "email", "role", "cohort"]
     updates = {}
     changed_fields = []
 
+    # la cohorte se valida como en los requests (400 si es inválida, ver cohorts.py)
+    if "cohort" in data:
+        data["cohort"] = parse_cohort(data["cohort"])
+
     for field in updatable_fields:
         if field in data and data[field] != user.get(field):
             updates[field] = data[field]
             changed_fields.append(field)
 
+    # users.exp es la exp de la cohorte actual: se recalcula para la nueva
+    if "cohort" in updates:
+        updates["exp"] = cohort_exp(user["_id"], updates["cohort"])
+
     # Manejo de cambio de contraseña si se proporciona nueva contraseña
     if "password" in data:
         # Hashear y preparar nueva contraseña
-        updates["password"] = generate_password_hash(data["password"])
+        updates["password"] = hash_password(data["password"])
         # Notificar que contraseña cambió, sin revelar valor
         changed_fields.append("password")
 
@@ -381,7 +329,11 @@ def update_user(id):
         return jsonify({"message": "Usuario sin cambios"}), 200
 
     # Aplicar actualización en MongoDB
-    mongo.db.users.update_one({"_id": ObjectId(id)}, {"$set": updates})
+    before = mongo.db.users.find_one_and_update({"_id": ObjectId(id)}, {"$set": updates},
+                                                projection={"exp": 1, "cohort": 1})
+    # al cambiar de cohorte cambia de ranking y de exp (ver leaderboard.py)
+    if before and "cohort" in updates:
+        move_buckets(user_moves(before, updates))
 
     # Preparar y enviar correo de notificación
     # Excluir 'password' de la lista de campos mostrados
@@ -409,9 +361,8 @@ def update_user(id):
 
         msg.body = text_body
         msg.html = html_body
-        # Enviar usando la extensión mail
-        mail = current_app.extensions['mail']
-        mail.send(msg)
+        # Se encola; el worker de la bandeja de salida lo envía
+        enqueue_mail(msg)
 
     return jsonify({"message": "Usuario actualizado exitosamente"}), 200
 
@@ -419,6 +370,13 @@ def update_user(id):
 @users_bp.route('/users/upload', methods=['POST'])
 #@jwt_required()
 def upload_users():
+    """
+    Importa alumnos desde un CSV (ver importer.py). Devuelve created, skipped y
+    el resultado de cada fila. Con `?background=1` la importación corre en
+    segundo plano y se responde 202 con un job_id para consultar el progreso
+    en GET /users/upload/<job_id>. Los alumnos quedan en la cohorte del
+    request (ver cohorts.py).
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No se envió ningún archivo"}), 400
 
@@ -426,51 +384,35 @@ def upload_users():
     fname = secure_filename(file.filename)
     if not fname.lower().endswith('.csv'):
         return jsonify({"error": "Sólo CSV permitido"}), 400
+    cohort = request_cohort()
+
+    if request.args.get("background") in ("1", "true"):
+        # El archivo del request deja de existir al responder: lo copiamos a un temporal
+        tmp = tempfile.TemporaryFile()
+        shutil.copyfileobj(file.stream, tmp)
+        tmp.seek(0)
+        text_stream = io.TextIOWrapper(tmp, encoding='utf-8', newline='')
+        job_id = start_import_job(current_app._get_current_object(), text_stream, cohort)
+        return jsonify({"job_id": str(job_id)}), 202
+
+    # Leemos el CSV de a bloques, sin cargarlo entero en memoria
+    text_stream = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
+    try:
+        summary = import_users(text_stream, cohort=cohort)
+    except UnicodeDecodeError:
+        return jsonify({"error": "El CSV debe estar codificado en UTF-8"}), 400
+
+    return jsonify(summary), 200
 
-    # Leemos todo el CSV en memoria
-    text = file.stream.read().decode('utf-8')
-    stream = io.StringIO(text)
-    # Si tu CSV NO trae cabecera, pásale fieldnames; si trae cabecera, quita fieldnames
-    reader = csv.DictReader(stream,
-                            fieldnames=['DNI','clave','lastname','name','email'],
-                            delimiter=';'
-                            )
-
-    created = 0
-    skipped = 0
-
-    for row in reader:
-        # usamos .get para no petar si la clave no existe
-        dni       = row.get('DNI', '').strip()
-        name      = row.get('name', '').strip()
-        lastname  = row.get('lastname', '').strip()
-        email     = row.get('email', '').strip()
-
-        if not (dni and name and email):
-            # fila incompleta → la saltamos
-            continue
-
-        if mongo.db.users.find_one({"DNI": dni}):
-            skipped += 1
-            continue
-
-        pwd    = generate_random_password(12)
-        hashed = generate_password_hash(pwd)
-
-        mongo.db.users.insert_one({
-            "DNI":        dni,
-            "name":       name,
-            "lastname":   lastname,
-            "email":      email,
-            "password":   hashed,
-            "role":       "user"
-        })
-
-        # enviamos mail con credenciales
-        msg = Message("Tus credenciales", recipients=[email])
-        msg.body = f"Hola {name},\n\nDNI: {dni}\nPassword: {pwd}\n"
-        mail.send(msg)
-
-        created += 1
-
-    return jsonify({"created": created, "skipped": skipped}), 200
\ No newline at end of file
+
+@users_bp.route('/users/upload/<job_id>', methods=['GET'])
+#@jwt_required()
+def upload_users_status(job_id):
+    """Progreso de una importación lanzada con /users/upload?background=1."""
+    try:
+        job = mongo.db.import_jobs.find_one({"_id": ObjectId(job_id)})
+    except Exception:
+        return jsonify({"error": "job_id inválido"}), 400
+    if not job:
+        return jsonify({"error": "Importación no encontrada"}), 404
+    return jsonify(job), 200
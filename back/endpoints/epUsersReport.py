@@ -1,19 +1,160 @@
-from flask import Blueprint, request, jsonify
+import csv
+import io
+import zlib
+from flask import Blueprint, Response, current_app, request, jsonify
 from bson import ObjectId
 from extensions import mongo
+from catalog import catalog
 from flask_jwt_extended import jwt_required
+from json_provider import stream_json_array
+from progress import summarize
+from cohorts import request_cohort, scoped
 # Asegúrate de tener importado ObjectId para convertir strings a ObjectId
 
 report_bp = Blueprint('report', __name__)
 
+REPORT_BATCH_SIZE = 200
+REPORT_FORMATS = ('json', 'ndjson', 'ndjson.gz', 'csv')
+
+
+def _batched(cursor, size):
+    """Agrupa los documentos de un cursor en listas de a lo sumo `size`."""
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_user_reports(users, batch_size=REPORT_BATCH_SIZE, question_ids=None, cohort=None):
+    """
+    Genera el informe de cada usuario procesándolos por lotes: por cada lote se
+    traen sus respuestas con una sola consulta y las preguntas referenciadas con
+    un único `$in`, así la memoria depende del tamaño del lote y no del total.
+    Con `question_ids` sólo se incluyen las respuestas a esas preguntas y con
+    `cohort` sólo las de esa cohorte.
+    """
+    for batch in _batched(users, batch_size):
+        user_ids = [u["_id"] for u in batch]
+        answers_by_user = {uid: [] for uid in user_ids}
+        query = scoped({"user_id": {"$in": user_ids}}, cohort)
+        if question_ids is not None:
+            query["question_id"] = {"$in": list(question_ids)}
+        for answer in mongo.db.answers.find(query):
+            answers_by_user[answer["user_id"]].append(answer)
+
+        # preguntas del lote (no pisar `question_ids`, el filtro del llamador)
+        batch_qids = list({a.get("question_id") for answers in answers_by_user.values() for a in answers})
+        questions = {q["_id"]: q for q in mongo.db.questions.find({"_id": {"$in": batch_qids}})}
+
+        for user in batch:
+            yield build_user_report(user, answers_by_user[user["_id"]], questions)
+
+
+def build_user_report(user, answers, questions):
+    """Arma el informe de un usuario anidando cada respuesta con su pregunta."""
+    questions_list = []
+    for answer in answers:
+        questions_list.append({
+            "question": questions.get(answer.get("question_id")),
+            "answer": answer
+        })
+    return {
+        "user": {
+            "id": str(user["_id"]),
+            "DNI": user.get("DNI"),
+            "name": user.get("name"),
+            "lastname": user.get("lastname")
+        },
+        "questions_answered": questions_list
+    }
+
+
+def iter_csv_rows(users, units, batch_size=REPORT_BATCH_SIZE):
+    """
+    Filas del informe en CSV: datos del usuario, su exp total y, por cada
+    unidad de `units`, las preguntas resueltas y la exp obtenida. Se leen del
+    progreso materializado y de unit_scores por lotes, sin recorrer respuestas.
+    """
+    yield ["user_id", "DNI", "name", "lastname", "exp"] + [
+        f"{unit.get('title')} {col}" for unit in units for col in ("resueltas", "exp")
+    ]
+    unit_ids = [unit["_id"] for unit in units]
+    for batch in _batched(users, batch_size):
+        user_ids = [u["_id"] for u in batch]
+        progress = {
+            p["_id"]: p.get("units", {})
+            for p in mongo.db.user_progress.find({"_id": {"$in": user_ids}})
+        }
+        scores = {
+            (s["user_id"], s["unit_id"]): s.get("exp", 0)
+            for s in mongo.db.unit_scores.find({"unit_id": {"$in": unit_ids}, "user_id": {"$in": user_ids}})
+        }
+        for user in batch:
+            solved = summarize(progress.get(user["_id"], {}))
+            row = [str(user["_id"]), user.get("DNI"), user.get("name"), user.get("lastname"), user.get("exp", 0)]
+            for unit_id in unit_ids:
+                row += [len(solved.get(str(unit_id), [])), scores.get((user["_id"], unit_id), 0)]
+            yield row
+
+
+def _csv_lines(rows):
+    # BOM para que Excel lo abra como UTF-8 (tildes en nombres y unidades)
+    yield "\ufeff".encode("utf-8")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _gzip(chunks):
+    """Comprime con gzip a medida que se generan los datos."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _parse_ids(value, name):
+    """Lista de ObjectId de un parámetro separado por comas; ValueError si alguno es inválido."""
+    try:
+        return [ObjectId(v.strip()) for v in value.split(",") if v.strip()]
+    except Exception:
+        raise ValueError(f"{name} inválido")
+
+
+def _download(body, mimetype, filename):
+    return Response(body, mimetype=mimetype, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @report_bp.route('/users/report', methods=['GET'])
 # @jwt_required()
 def user_report():
     """
     Genera un informe de respuestas.
-    - Si se envía el parámetro de consulta `user_id`, genera el informe solo para ese usuario.
-    - Si no se envía, genera el informe para todos los usuarios.
-    
+    - Si se envía el parámetro de consulta `user_id`, genera el informe solo para ese
+      usuario: con format=json un objeto y con los demás formatos lo mismo que
+      para varios usuarios, con una sola fila o línea.
+    - Si no se envía, genera el informe para todos los usuarios. La respuesta se
+      transmite a medida que se genera, según `format`:
+        - json (por defecto): un array JSON por partes.
+        - ndjson: un usuario por línea; ndjson.gz: lo mismo comprimido con gzip.
+        - csv: una fila por usuario con su exp y, por unidad, preguntas
+          resueltas y exp (columnas "<unidad> resueltas" y "<unidad> exp").
+    - `user_ids` (separados por coma) limita el informe a esos usuarios y
+      `unit_id` (uno o varios, separados por coma) a las preguntas o columnas
+      de esas unidades. Los filtros se aplican en las consultas a MongoDB.
+    - Sólo incluye los usuarios, unidades y respuestas de la cohorte del
+      request (X-Cohort, ?cohort= o CURRENT_COHORT; ver cohorts.py).
+
     El informe de cada usuario contiene:
       - id, name y lastname.
       - Una lista de preguntas respondidas, cada una con:
@@ -21,33 +162,19 @@ def user_report():
           - la respuesta dada por el usuario.
     """
     user_id = request.args.get('user_id')
-    report = []
-
-    def build_user_report(user):
-        # Obtiene todas las respuestas del usuario y anida la información de la pregunta
-        user_obj_id = user["_id"]
-        answers_cursor = mongo.db.answers.find({"user_id": user_obj_id})
-        questions_list = []
-        for answer in answers_cursor:
-            q_id = answer.get("question_id")
-            question = mongo.db.questions.find_one({"_id": q_id})
-            if question:
-                question["_id"] = str(question["_id"])
-            answer["_id"] = str(answer["_id"])
-            answer["question_id"] = str(q_id)
-            questions_list.append({
-                "question": question,
-                "answer": answer
-            })
-        return {
-            "user": {
-                "id": str(user_obj_id),
-                "DNI": user.get("DNI"),
-                "name": user.get("name"),
-                "lastname": user.get("lastname")
-            },
-            "questions_answered": questions_list
-        }
+    fmt = request.args.get('format', 'json')
+    if fmt not in REPORT_FORMATS:
+        return jsonify({"error": "format inválido"}), 400
+    try:
+        user_ids = _parse_ids(request.args.get('user_ids', ''), "user_ids")
+        unit_ids = _parse_ids(request.args.get('unit_id', ''), "unit_id")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cohort = request_cohort()
+
+    question_ids = None
+    if unit_ids:
+        question_ids = [q["_id"] for unit_id in unit_ids for q in catalog.questions_by_unit(unit_id)]
 
     if user_id:
         # Informe para un usuario específico
@@ -59,11 +186,32 @@ def user_report():
         user = mongo.db.users.find_one({"_id": user_obj_id})
         if not user:
             return jsonify({"error": "Usuario no encontrado"}), 404
-        report = build_user_report(user)
+        if fmt == 'json':
+            # un objeto, no un array (como siempre devolvió este caso)
+            report = next(iter_user_reports([user], question_ids=question_ids, cohort=cohort))
+            return jsonify(report), 200
+        # los demás formatos, igual que para varios usuarios
+        users_cursor = [user]
     else:
-        # Informe para todos los usuarios
-        users_cursor = mongo.db.users.find()
-        for user in users_cursor:
-            report.append(build_user_report(user))
+        # Informe para todos los usuarios (o los de user_ids), generado y enviado por lotes
+        users_query = scoped({"_id": {"$in": user_ids}} if user_ids else {}, cohort)
+        users_cursor = mongo.db.users.find(users_query, {"DNI": 1, "name": 1, "lastname": 1, "exp": 1}).sort("_id", 1)
+
+    if fmt == 'csv':
+        units = sorted(catalog.units(cohort), key=lambda u: (u.get("level") or 0, str(u.get("title"))))
+        if unit_ids:
+            units = [u for u in units if u["_id"] in unit_ids]
+        return _download(_csv_lines(iter_csv_rows(users_cursor, units)), "text/csv", "informe.csv"), 200
+
+    reports = iter_user_reports(users_cursor, question_ids=question_ids, cohort=cohort)
+    if fmt in ('ndjson', 'ndjson.gz'):
+        dumps = current_app.json.dumps_bytes
+
+        def generate_ndjson():
+            for report in reports:
+                yield dumps(report) + b"\n"
 
-    return jsonify(report), 200
\ No newline at end of file
+        if fmt == 'ndjson.gz':
+            return _download(_gzip(generate_ndjson()), "application/gzip", "informe.ndjson.gz"), 200
+        return Response(generate_ndjson(), mimetype="application/x-ndjson"), 200
+    return Response(stream_json_array(reports), mimetype="application/json"), 200
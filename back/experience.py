@@ -0,0 +1,361 @@
+# experience.py
+#
+# Libro mayor de experiencia: un documento por (usuario, pregunta) en la
+# colección `exp_ledger` con la exp otorgada, y el total acumulado en
+# `users.exp`. `create_answer` lo actualiza de forma incremental, así
+# `/users` y `/profile` leen la exp sin recalcular nada. Con la exp se
+# actualizan también el progreso materializado (ver progress.py) y los
+# rankings por unidad (ver leaderboard.py).
+#
+# users.exp es la exp de la cohorte actual del usuario (ver cohorts.py): sólo
+# suman las preguntas de unidades de esa cohorte (el update filtra por la
+# cohorte del usuario) y al cambiarlo de cohorte se recalcula con cohort_exp.
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+
+from extensions import mongo
+from catalog import catalog
+from grading import grade
+from progress import progress_update, progress_bulk_ops
+from leaderboard import inc_user_exp, inc_unit_score, move_buckets, user_moves
+from cohorts import cohort_of, cohort_question_ids
+
+
+def compute_awarded_exp(question, help_doc):
+    """Exp neta de una respuesta correcta descontando las penalizaciones por hints."""
+    help_doc = help_doc or {}
+    total_penalty = 0.0
+    if help_doc.get("usedHelp1"):
+        total_penalty += question.get("hint1", {}).get("penalty", 0)
+    if help_doc.get("usedHelp2"):
+        total_penalty += question.get("hint2", {}).get("penalty", 0)
+    total_penalty = min(total_penalty, 1.0)
+    return int(question.get("exp", 0) * (1 - total_penalty))
+
+
+def exp_updates(user_id, question, exp_awarded):
+    """
+    Actualizaciones del libro mayor y del progreso que registran una
+    respuesta correcta a `question`, como una lista de (colección, filtro,
+    update, upsert). La usa record_exp.
+    """
+    return [
+        ("exp_ledger",
+         {"user_id": user_id, "question_id": question["_id"]},
+         {"$inc": {"exp": exp_awarded, "correct": 1}},
+         True),
+        progress_update(user_id, question)
+    ]
+
+
+def record_exp(user_id, question, exp_awarded, cohort):
+    """
+    Registra la exp otorgada en el libro mayor, el total del usuario (sólo si
+    está en `cohort`, la de la pregunta), su progreso y su puntaje en la
+    unidad, y mueve el histograma de los rankings (ver leaderboard.py).
+    """
+    for collection, filter_, update, upsert in exp_updates(user_id, question, exp_awarded):
+        mongo.db[collection].update_one(filter_, update, upsert=upsert)
+    move_buckets(
+        inc_user_exp(user_id, cohort, exp_awarded)
+        + inc_unit_score(user_id, question.get("unit_id"), exp_awarded)
+    )
+
+
+def record_exp_many(awards):
+    """
+    Como record_exp para una lista de (user_id, question, exp): agrupa por
+    (usuario, pregunta), por usuario y por (unidad, usuario). El libro mayor
+    y el progreso van con un bulk_write; users y unit_scores con un
+    find_one_and_update por documento, para mover el histograma con la exp
+    que tenía cada uno.
+    """
+    by_pair = {}
+    by_user = {}
+    by_unit = {}
+    for user_id, question, exp_awarded in awards:
+        pair = by_pair.setdefault((user_id, question["_id"]), {"exp": 0, "correct": 0})
+        pair["exp"] += exp_awarded
+        pair["correct"] += 1
+        key = (user_id, cohort_of(question))
+        by_user[key] = by_user.get(key, 0) + exp_awarded
+        key = (user_id, question.get("unit_id"))
+        by_unit[key] = by_unit.get(key, 0) + exp_awarded
+    if not by_pair:
+        return
+    mongo.db.exp_ledger.bulk_write([
+        UpdateOne({"user_id": uid, "question_id": qid}, {"$inc": inc}, upsert=True)
+        for (uid, qid), inc in by_pair.items()
+    ], ordered=False)
+    mongo.db.user_progress.bulk_write(
+        progress_bulk_ops([(user_id, question) for user_id, question, _ in awards]),
+        ordered=False
+    )
+    moves = []
+    for (uid, cohort), total in by_user.items():
+        moves += inc_user_exp(uid, cohort, total)
+    for (uid, unit_id), total in by_unit.items():
+        moves += inc_unit_score(uid, unit_id, total)
+    move_buckets(moves)
+
+
+def cohort_exp(user_id, cohort):
+    """Exp del usuario en las preguntas de `cohort` según el libro mayor (el valor de users.exp en esa cohorte)."""
+    rows = mongo.db.exp_ledger.aggregate([
+        {"$match": {"user_id": user_id, "question_id": {"$in": cohort_question_ids(cohort)}}},
+        {"$group": {"_id": None, "exp": {"$sum": "$exp"}}}
+    ])
+    return next(rows, {}).get("exp", 0)
+
+
+def _recompute_chunk(user_ids, questions):
+    """
+    Recalcula desde `answers` y `question_helps` la exp de un grupo de usuarios.
+    Devuelve {user_id: {question_id: {"exp": int, "correct": int}}}.
+    """
+    db = mongo.db
+    helps = {
+        (h["user_id"], h["question_id"]): h
+        for h in db.question_helps.find({"user_id": {"$in": user_ids}})
+    }
+    entries = {uid: {} for uid in user_ids}
+    answers = list(db.answers.find(
+        {"user_id": {"$in": user_ids}},
+        {"user_id": 1, "question_id": 1, "selectedOption": 1, "body": 1}
+    ))
+    for ans, correct in zip(answers, grade(answers, questions)):
+        if not correct:
+            continue
+        q = questions[ans["question_id"]]
+        awarded = compute_awarded_exp(q, helps.get((ans["user_id"], q["_id"])))
+        entry = entries[ans["user_id"]].setdefault(q["_id"], {"exp": 0, "correct": 0})
+        entry["exp"] += awarded
+        entry["correct"] += 1
+    return entries
+
+
+def _reconcile_chunk(user_ids, questions, fix):
+    """Compara el libro mayor de un grupo de usuarios con lo recalculado."""
+    db = mongo.db
+    expected = _recompute_chunk(user_ids, questions)
+
+    ledger_totals = {uid: 0 for uid in user_ids}
+    for row in db.exp_ledger.find({"user_id": {"$in": user_ids}}, {"user_id": 1, "exp": 1}):
+        ledger_totals[row["user_id"]] += row.get("exp", 0)
+    stored = {u["_id"]: u for u in db.users.find({"_id": {"$in": user_ids}}, {"exp": 1, "cohort": 1})}
+
+    def cohort_total(uid):
+        # users.exp sólo cuenta la cohorte actual del usuario
+        cohort = stored.get(uid, {}).get("cohort")
+        return sum(e["exp"] for qid, e in expected[uid].items() if cohort_of(questions[qid]) == cohort)
+
+    drift = []
+    for uid in user_ids:
+        real = sum(e["exp"] for e in expected[uid].values())
+        users_exp = stored.get(uid, {}).get("exp", 0)
+        if ledger_totals[uid] != real or users_exp != cohort_total(uid):
+            drift.append({
+                "user_id": str(uid),
+                "ledger": ledger_totals[uid],
+                "users_exp": users_exp,
+                "expected": real,
+                "expected_users_exp": cohort_total(uid)
+            })
+
+    if fix and drift:
+        drifted_ids = {d["user_id"] for d in drift}
+        drifted = [uid for uid in user_ids if str(uid) in drifted_ids]
+        db.exp_ledger.delete_many({"user_id": {"$in": drifted}})
+        docs = [
+            {"user_id": uid, "question_id": qid, "exp": e["exp"], "correct": e["correct"]}
+            for uid in drifted
+            for qid, e in expected[uid].items()
+        ]
+        if docs:
+            db.exp_ledger.insert_many(docs, ordered=False)
+        moves = []
+        for uid in drifted:
+            before = db.users.find_one_and_update(
+                {"_id": uid}, {"$set": {"exp": cohort_total(uid)}}, projection={"exp": 1, "cohort": 1}
+            )
+            if before:
+                moves += user_moves(before, {"exp": cohort_total(uid)})
+        move_buckets(moves)
+
+    return drift
+
+
+def reconcile_ledger(chunk_size=500, workers=4, fix=False):
+    """
+    Recorre todos los usuarios en grupos de `chunk_size`, procesados en paralelo,
+    y devuelve la lista de usuarios cuya exp guardada no coincide con la real.
+    Con fix=True reescribe el libro mayor y `users.exp` de esos usuarios.
+    """
+    questions = catalog.questions()
+    user_ids = [u["_id"] for u in mongo.db.users.find({}, {"_id": 1})]
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+    drift = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk_drift in pool.map(lambda c: _reconcile_chunk(c, questions, fix), chunks):
+            drift.extend(chunk_drift)
+    return drift
+
+
+@click.command("reconcile-exp")
+@click.option("--chunk-size", default=500, show_default=True, help="Usuarios por grupo.")
+@click.option("--workers", default=4, show_default=True, help="Grupos procesados en paralelo.")
+@click.option("--fix", is_flag=True, help="Reescribe el libro mayor de los usuarios con diferencias.")
+@with_appcontext
+def reconcile_exp_command(chunk_size, workers, fix):
+    """Reconstruye/verifica el libro mayor de exp a partir de las respuestas."""
+    drift = reconcile_ledger(chunk_size=chunk_size, workers=workers, fix=fix)
+    for d in drift:
+        click.echo(
+            f"{d['user_id']}: ledger={d['ledger']} (esperado {d['expected']}) "
+            f"users.exp={d['users_exp']} (esperado {d['expected_users_exp']})"
+        )
+    accion = "corregidos" if fix else "con diferencias"
+    click.echo(f"{len(drift)} usuarios {accion}")
+
+
+def _normalize_expr(value):
+    # equivalente a grading.normalize
+    return {"$toLower": {"$trim": {"input": {"$toString": value}}}}
+
+
+def _number_expr(value):
+    # equivalente a grading.parse_number
+    return {"$convert": {
+        "input": {"$replaceAll": {"input": _normalize_expr(value), "find": ",", "replacement": "."}},
+        "to": "double", "onError": None, "onNull": None
+    }}
+
+
+def users_exp_pipeline(sort_field=None, descending=False, skip=0, limit=None, after=None, cohort=None):
+    """
+    Pipeline de agregación sobre `users` que calcula la exp real de cada usuario
+    a partir de `answers`, `questions` y `question_helps` en el servidor, con las
+    mismas reglas que grading.py y compute_awarded_exp. Con `after`
+    sólo considera usuarios con _id mayor (paginado por cursor) y con `cohort`
+    sólo los de esa cohorte.
+    """
+    # expectedAnswer más los alias aceptados
+    expected = {"$concatArrays": [
+        [{"$ifNull": ["$q.expectedAnswer", ""]}],
+        {"$ifNull": ["$q.acceptedAnswers", []]}
+    ]}
+    answers_pipeline = [
+        # como users.exp: sólo las respuestas de la cohorte del usuario
+        {"$match": {"$expr": {"$and": [
+            {"$eq": ["$user_id", "$$uid"]},
+            {"$eq": [{"$ifNull": ["$cohort", None]}, "$$cohort"]}
+        ]}}},
+        {"$project": {"question_id": 1, "selectedOption": 1, "body": 1}},
+        {"$lookup": {
+            "from": "questions",
+            "localField": "question_id",
+            "foreignField": "_id",
+            "as": "q"
+        }},
+        {"$unwind": "$q"},
+        # selectedOption es un índice; los valores no numéricos quedan en null
+        {"$addFields": {
+            "idx": {"$convert": {"input": "$selectedOption", "to": "int", "onError": None, "onNull": None}},
+            "num": _number_expr("$body")
+        }},
+        {"$match": {"$expr": {"$cond": [
+            {"$ne": [{"$ifNull": ["$selectedOption", None]}, None]},
+            {"$and": [
+                {"$ne": ["$idx", None]},
+                {"$gte": ["$idx", 0]},
+                {"$lt": ["$idx", {"$size": {"$ifNull": ["$q.options", []]}}]},
+                {"$eq": [
+                    {"$getField": {
+                        "field": "isCorrect",
+                        "input": {"$arrayElemAt": [{"$ifNull": ["$q.options", []]}, "$idx"]}
+                    }},
+                    True
+                ]}
+            ]},
+            {"$and": [
+                {"$ne": [{"$ifNull": ["$body", None]}, None]},
+                {"$or": [
+                    {"$in": [
+                        _normalize_expr("$body"),
+                        {"$map": {"input": expected, "as": "e", "in": _normalize_expr("$$e")}}
+                    ]},
+                    # respuestas numéricas con margen (question.tolerance)
+                    {"$and": [
+                        {"$ne": [{"$ifNull": ["$q.tolerance", None]}, None]},
+                        {"$ne": ["$num", None]},
+                        {"$anyElementTrue": [{"$map": {"input": expected, "as": "e", "in": {"$let": {
+                            "vars": {"n": _number_expr("$$e")},
+                            "in": {"$and": [
+                                {"$ne": ["$$n", None]},
+                                {"$lte": [{"$abs": {"$subtract": ["$num", "$$n"]}}, "$q.tolerance"]}
+                            ]}
+                        }}}}]}
+                    ]}
+                ]}
+            ]}
+        ]}}},
+        {"$lookup": {
+            "from": "question_helps",
+            "let": {"qid": "$question_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$uid"]},
+                    {"$eq": ["$question_id", "$$qid"]}
+                ]}}},
+                {"$limit": 1}
+            ],
+            "as": "help"
+        }},
+        {"$set": {"help": {"$ifNull": [{"$first": "$help"}, {}]}}},
+        {"$set": {"penalty": {"$min": [1, {"$add": [
+            {"$cond": ["$help.usedHelp1", {"$ifNull": ["$q.hint1.penalty", 0]}, 0]},
+            {"$cond": ["$help.usedHelp2", {"$ifNull": ["$q.hint2.penalty", 0]}, 0]}
+        ]}]}}},
+        {"$group": {
+            "_id": None,
+            "exp": {"$sum": {"$trunc": {"$multiply": [
+                {"$ifNull": ["$q.exp", 0]}, {"$subtract": [1, "$penalty"]}
+            ]}}}
+        }}
+    ]
+
+    paging = []
+    if sort_field:
+        paging.append({"$sort": {sort_field: -1 if descending else 1, "_id": 1}})
+    if skip:
+        paging.append({"$skip": skip})
+    if limit:
+        paging.append({"$limit": limit})
+
+    lookup = [
+        {"$lookup": {
+            "from": "answers",
+            "let": {"uid": "$_id", "cohort": {"$ifNull": ["$cohort", None]}},
+            "pipeline": answers_pipeline,
+            "as": "totals"
+        }},
+        {"$set": {"exp": {"$toInt": {"$ifNull": [{"$first": "$totals.exp"}, 0]}}}},
+        {"$unset": "totals"}
+    ]
+
+    match = {"_id": {"$gt": after}} if after is not None else {}
+    if cohort:
+        match["cohort"] = cohort
+    pipeline = [
+        {"$match": match},
+        {"$project": {"DNI": 1, "name": 1, "lastname": 1, "email": 1, "role": 1, "cohort": 1}}
+    ]
+    # Si el orden no depende de la exp, se pagina antes del $lookup y sólo se
+    # calcula la exp de los usuarios de la página
+    if sort_field == "exp":
+        return pipeline + lookup + paging
+    return pipeline + paging + lookup
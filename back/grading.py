@@ -0,0 +1,95 @@
+# grading.py
+#
+# Corrección de respuestas. Cada pregunta se compila una sola vez en un
+# corrector con las respuestas esperadas ya normalizadas y el conjunto de
+# opciones correctas; el corrector se guarda en cache por (_id, version) de la
+# pregunta, así que una pregunta editada (update_question incrementa `version`)
+# se vuelve a compilar. Todos los endpoints corrigen con grade().
+#
+# Campos de la pregunta que se usan:
+#   - options[i].isCorrect       (Choice; selectedOption es el índice i)
+#   - expectedAnswer             (OpenEntry)
+#   - acceptedAnswers            (OpenEntry, opcional: lista de alias válidos)
+#   - tolerance                  (OpenEntry, opcional: margen para respuestas numéricas)
+import threading
+
+from catalog import catalog
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def normalize(text):
+    """Normalización de las respuestas abiertas: sin espacios en los extremos y en minúsculas."""
+    return str(text).strip().lower()
+
+
+def parse_number(text):
+    """Interpreta '3,5' y '3.5' como 3.5; devuelve None si no es un número."""
+    try:
+        return float(normalize(text).replace(",", "."))
+    except ValueError:
+        return None
+
+
+class CompiledQuestion:
+    __slots__ = ("correct_options", "accepted", "numbers", "tolerance")
+
+    def __init__(self, question):
+        self.correct_options = frozenset(
+            i for i, opt in enumerate(question.get("options") or []) if opt.get("isCorrect")
+        )
+        expected = [question.get("expectedAnswer", "")] + list(question.get("acceptedAnswers") or [])
+        self.accepted = frozenset(normalize(e) for e in expected)
+        self.tolerance = question.get("tolerance")
+        if self.tolerance is not None:
+            self.numbers = tuple(n for n in map(parse_number, expected) if n is not None)
+        else:
+            self.numbers = ()
+
+    def __call__(self, answer):
+        """True si `answer` (dict con 'selectedOption' o 'body') es correcta."""
+        selected = answer.get("selectedOption")
+        if selected is not None:
+            try:
+                return int(selected) in self.correct_options
+            except (TypeError, ValueError):
+                return False
+        body = answer.get("body")
+        if body is None:
+            return False
+        if normalize(body) in self.accepted:
+            return True
+        if self.numbers:
+            value = parse_number(body)
+            return value is not None and any(abs(value - n) <= self.tolerance for n in self.numbers)
+        return False
+
+
+def compile_question(question):
+    """Devuelve el corrector de la pregunta, compilándolo sólo si cambió su versión."""
+    key = (question["_id"], question.get("version", 0))
+    grader = _cache.get(key)
+    if grader is None:
+        grader = CompiledQuestion(question)
+        with _cache_lock:
+            # descartamos las versiones anteriores de la misma pregunta
+            for old in [k for k in _cache if k[0] == key[0]]:
+                del _cache[old]
+            _cache[key] = grader
+    return grader
+
+
+def grade(answers, questions=None):
+    """
+    Corrige una lista de respuestas (dicts con question_id y selectedOption o
+    body). Devuelve una lista de bool en el mismo orden; None si la pregunta no
+    existe. `questions` es un dict {_id: pregunta}; por defecto el catálogo.
+    """
+    if questions is None:
+        questions = catalog.questions()
+    results = []
+    for answer in answers:
+        q = questions.get(answer.get("question_id"))
+        results.append(compile_question(q)(answer) if q else None)
+    return results
@@ -0,0 +1,69 @@
+# http_cache.py
+#
+# Cache HTTP para los endpoints del catálogo (unidades y preguntas). El ETag
+# se deriva de la versión del catálogo (catalog.py), así un If-None-Match
+# vigente se responde con 304 sin consultar las colecciones; además se agrega
+# Cache-Control y se comprimen las respuestas grandes con brotli (si está
+# instalado) o gzip. El ETag incluye la cohorte del request (ver cohorts.py).
+import gzip
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from catalog import catalog
+from cohorts import COHORT_HEADER, request_cohort
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional
+    brotli = None
+
+DEFAULT_CACHE_CONTROL = "no-cache"
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+
+
+def _encodings():
+    return ["br", "gzip"] if brotli else ["gzip"]
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def catalog_cached(view):
+    """Decorador para los GET cuyo contenido sólo cambia con la versión del catálogo."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache_control = current_app.config.get("CATALOG_CACHE_CONTROL", DEFAULT_CACHE_CONTROL)
+        etag = f"catalog-{catalog.version}"
+        # el contenido depende también de la cohorte (ver cohorts.py)
+        cohort = request_cohort()
+        if cohort:
+            etag = f"{etag}-{cohort}"
+
+        # Cualquier variante (sin comprimir, gzip o br) de esta versión sigue vigente
+        if any(request.if_none_match.contains(tag) for tag in
+               [etag] + [f"{etag}-{enc}" for enc in _encodings()]):
+            resp = make_response("", 304)
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = cache_control
+            return resp
+
+        resp = make_response(view(*args, **kwargs))
+        if resp.status_code != 200:
+            return resp
+
+        resp.headers["Cache-Control"] = cache_control
+        resp.vary.add("Accept-Encoding")
+        resp.vary.add(COHORT_HEADER)
+        encoding = request.accept_encodings.best_match(_encodings())
+        min_size = current_app.config.get("COMPRESS_MIN_SIZE", DEFAULT_COMPRESS_MIN_SIZE)
+        if encoding and resp.content_length and resp.content_length >= min_size:
+            resp.set_data(_compress(resp.get_data(), encoding))
+            resp.headers["Content-Encoding"] = encoding
+            etag = f"{etag}-{encoding}"
+        resp.set_etag(etag)
+        return resp
+    return wrapper
@@ -0,0 +1,108 @@
+# idempotency.py
+#
+# Claves de idempotencia para POST /answers y POST /answers/batch. El cliente
+# manda un header Idempotency-Key (un UUID por envío, el mismo en cada
+# reintento). La primera vez se reserva la clave en `idempotency_keys` y, al
+# terminar, se guarda la respuesta; un reintento con la misma clave recibe esa
+# respuesta sin volver a escribir nada. Las claves vencen solas por un índice
+# TTL sobre created_at (ver indexes.py).
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, jsonify, make_response
+from pymongo.errors import DuplicateKeyError
+
+from extensions import mongo
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# tiempo durante el cual un reintento recibe la respuesta original
+KEY_TTL = timedelta(hours=24)
+# una clave reservada por un request que no terminó (p.ej. el worker murió) se libera pasado este tiempo
+PENDING_TIMEOUT = timedelta(seconds=30)
+MAX_KEY_LENGTH = 200
+
+
+def request_key(scope):
+    """(_id de la clave, huella del cuerpo) del request actual, o (None, None) si no trae la clave."""
+    key = request.headers.get(IDEMPOTENCY_HEADER, "").strip()
+    if not key:
+        return None, None
+    body = json.dumps(request.get_json(silent=True), sort_keys=True, default=str)
+    return f"{scope}:{key[:MAX_KEY_LENGTH]}", hashlib.sha256(body.encode()).hexdigest()
+
+
+def claim(key_id, fingerprint):
+    """
+    Reserva la clave. Devuelve None si es nueva (el request debe procesarse) o
+    el documento guardado si ya se usó (ver replay).
+    """
+    now = datetime.utcnow()
+    try:
+        mongo.db.idempotency_keys.insert_one({
+            "_id": key_id, "fingerprint": fingerprint, "status": "pending", "created_at": now
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # quedó reservada por un request que no terminó: se la toma de nuevo
+    stale = mongo.db.idempotency_keys.find_one_and_update(
+        {"_id": key_id, "status": "pending", "created_at": {"$lt": now - PENDING_TIMEOUT}},
+        {"$set": {"fingerprint": fingerprint, "created_at": now}}
+    )
+    if stale:
+        return None
+    return mongo.db.idempotency_keys.find_one({"_id": key_id}) or {"status": "pending"}
+
+
+def complete(key_id, response, status):
+    """Guarda la respuesta de un request ya procesado para devolverla en los reintentos."""
+    mongo.db.idempotency_keys.update_one(
+        {"_id": key_id},
+        {"$set": {"status": "done", "response": response, "code": status}}
+    )
+
+
+def release(key_id):
+    """Libera la clave de un request que falló, así el reintento se procesa."""
+    mongo.db.idempotency_keys.delete_one({"_id": key_id, "status": "pending"})
+
+
+def replay(doc, fingerprint):
+    """Respuesta para un reintento con una clave ya usada."""
+    if doc.get("fingerprint") not in (None, fingerprint):
+        return jsonify({"error": f"{IDEMPOTENCY_HEADER} ya usada con otro contenido"}), 422
+    if doc.get("status") != "done":
+        return jsonify({"error": "La solicitud original todavía se está procesando"}), 409, {"Retry-After": "1"}
+    return jsonify(doc["response"]), doc["code"], {"Idempotent-Replayed": "true"}
+
+
+def idempotent(scope):
+    """
+    Decorador para vistas que devuelven (jsonify(...), status): si el request
+    trae Idempotency-Key, procesa la vista una sola vez por clave y repite la
+    respuesta guardada en los reintentos.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key_id, fingerprint = request_key(scope)
+            if key_id is None:
+                return view(*args, **kwargs)
+
+            doc = claim(key_id, fingerprint)
+            if doc is not None:
+                return replay(doc, fingerprint)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                release(key_id)
+                raise
+            if response.status_code >= 500:
+                release(key_id)
+            else:
+                complete(key_id, response.get_json(), response.status_code)
+            return response
+        return wrapper
+    return decorator
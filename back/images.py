@@ -0,0 +1,102 @@
+# images.py
+#
+# Variantes de las imágenes de las preguntas. Al subir una imagen se guarda con
+# el hash de su contenido como nombre (<hash>.<ext>) y se generan versiones
+# redimensionadas en WebP y en el formato original (<hash>-<ancho>.<ext>). La
+# extensión sale del formato real de la imagen, no del nombre subido: JPEG,
+# PNG y GIF se guardan tal cual y los demás formatos se convierten a PNG.
+# Como el nombre depende del contenido, esos archivos nunca cambian y se pueden
+# cachear indefinidamente en el navegador.
+import hashlib
+import io
+import os
+import re
+
+from PIL import Image, UnidentifiedImageError
+
+VARIANT_WIDTHS = (320, 640, 1280)
+HASHED_NAME = re.compile(r"^([0-9a-f]{16})\.(png|jpg|jpeg|gif)$")
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+# formato de PIL -> extensión con la que se guarda
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif"}
+
+
+class InvalidImage(ValueError):
+    """Los datos subidos no son una imagen que se pueda procesar."""
+
+
+def _save(img, path, fmt):
+    if fmt == "WEBP":
+        img.save(path, "WEBP", quality=WEBP_QUALITY, method=4)
+    elif fmt == "JPEG":
+        img.convert("RGB").save(path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        img.save(path, fmt, optimize=True)
+
+
+def store_image(data, folder):
+    """
+    Guarda la imagen `data` (bytes) en `folder` con nombre <hash>.<ext> y genera
+    sus variantes. Devuelve el nombre del archivo original. Lanza InvalidImage
+    si no es una imagen válida o es demasiado grande (decompression bomb).
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+
+    fmt = img.format if img.format in FORMAT_EXTENSIONS else "PNG"
+    ext = FORMAT_EXTENSIONS[fmt]
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    filename = f"{digest}.{ext}"
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        # mismo contenido ya subido: las variantes también existen
+        return filename
+
+    if fmt == img.format:
+        with open(path, "wb") as f:
+            f.write(data)
+    else:
+        _save(img, path, fmt)
+
+    if fmt == "GIF" and getattr(img, "is_animated", False):
+        # los GIF animados se sirven tal cual
+        return filename
+
+    _save(img, os.path.join(folder, f"{digest}.webp"), "WEBP")
+    for width in VARIANT_WIDTHS:
+        if width >= img.width:
+            break
+        height = round(img.height * width / img.width)
+        resized = img.resize((width, height), Image.LANCZOS)
+        _save(resized, os.path.join(folder, f"{digest}-{width}.webp"), "WEBP")
+        _save(resized, os.path.join(folder, f"{digest}-{width}.{ext}"), fmt)
+    return filename
+
+
+def pick_variant(filename, folder, width=None, accepts_webp=False):
+    """
+    Elige el archivo a servir para `filename`: el ancho más chico que sea >= a
+    `width` (o el original) y WebP si el cliente lo acepta y existe.
+    Devuelve (nombre, es_inmutable). Las imágenes con nombre no hasheado
+    (subidas antes de las variantes) se devuelven tal cual.
+    """
+    match = HASHED_NAME.match(filename)
+    if not match:
+        return filename, False
+    digest, ext = match.groups()
+
+    candidates = []
+    if width:
+        candidates = [w for w in VARIANT_WIDTHS if w >= width]
+    for w in candidates[:1]:
+        for variant_ext in (["webp"] if accepts_webp else []) + [ext]:
+            name = f"{digest}-{w}.{variant_ext}"
+            if os.path.exists(os.path.join(folder, name)):
+                return name, True
+    if accepts_webp and os.path.exists(os.path.join(folder, f"{digest}.webp")):
+        return f"{digest}.webp", True
+    return filename, True
@@ -0,0 +1,174 @@
+# importer.py
+#
+# Importación masiva de alumnos desde CSV (DNI;clave;apellido;nombre;email,
+# sin cabecera). El archivo se procesa en bloques: un solo `$in` por bloque
+# para detectar DNIs ya registrados, las contraseñas se hashean en paralelo
+# (passwords.hash_many), los usuarios se insertan con un bulk_write no
+# ordenado y los correos con las credenciales se encolan de una sola vez.
+import csv
+import threading
+from datetime import datetime
+
+from flask_mail import Message
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+from extensions import mongo
+from outbox import enqueue_mails
+from passwords import hash_many
+from utils import generate_random_password
+from leaderboard import move_buckets, user_boards
+
+CSV_FIELDS = ['DNI', 'clave', 'lastname', 'name', 'email']
+CHUNK_SIZE = 500
+
+
+def _chunks(reader, size):
+    chunk = []
+    for row in reader:
+        chunk.append((reader.line_num, row))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _import_chunk(rows, seen_dnis, cohort=None):
+    """Importa un bloque de filas y devuelve el resultado de cada una."""
+    results = []
+    candidates = []
+    for line, row in rows:
+        # usamos .get para no petar si la clave no existe
+        dni = (row.get('DNI') or '').strip()
+        name = (row.get('name') or '').strip()
+        lastname = (row.get('lastname') or '').strip()
+        email = (row.get('email') or '').strip()
+
+        if not (dni and name and email):
+            results.append({"row": line, "DNI": dni, "status": "invalid", "reason": "Fila incompleta"})
+        elif dni in seen_dnis:
+            results.append({"row": line, "DNI": dni, "status": "skipped", "reason": "DNI repetido en el archivo"})
+        else:
+            seen_dnis.add(dni)
+            candidates.append((line, dni, name, lastname, email))
+
+    # una sola consulta para todos los DNIs del bloque
+    existing = {
+        u["DNI"] for u in mongo.db.users.find(
+            {"DNI": {"$in": [c[1] for c in candidates]}}, {"DNI": 1}
+        )
+    }
+    new_rows = []
+    for c in candidates:
+        if c[1] in existing:
+            results.append({"row": c[0], "DNI": c[1], "status": "skipped", "reason": "El usuario ya existe"})
+        else:
+            new_rows.append(c)
+    if not new_rows:
+        results.sort(key=lambda r: r["row"])
+        return results
+
+    passwords = [generate_random_password(12) for _ in new_rows]
+    hashes = hash_many(passwords)
+    extra = {"cohort": cohort} if cohort else {}
+    ops = [
+        InsertOne({
+            "DNI": dni,
+            "name": name,
+            "lastname": lastname,
+            "email": email,
+            "password": hashed,
+            "role": "user",
+            "exp": 0,
+            **extra
+        })
+        for (_, dni, name, lastname, email), hashed in zip(new_rows, hashes)
+    ]
+
+    failed = {}
+    try:
+        mongo.db.users.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # p.ej. un DNI insertado por otro request entre el $in y el bulk_write
+        for err in e.details.get("writeErrors", []):
+            failed[err["index"]] = err.get("errmsg", "Error de escritura")
+    # los creados entran a los rankings con 0 de exp (ver leaderboard.py)
+    move_buckets([(user_boards(cohort), None, 0)] * (len(ops) - len(failed)))
+
+    msgs = []
+    for i, ((line, dni, name, lastname, email), pwd) in enumerate(zip(new_rows, passwords)):
+        if i in failed:
+            results.append({"row": line, "DNI": dni, "status": "error", "reason": failed[i]})
+            continue
+        results.append({"row": line, "DNI": dni, "status": "created"})
+        # mail con credenciales
+        msg = Message("Tus credenciales", recipients=[email])
+        msg.body = f"Hola {name},\n\nDNI: {dni}\nPassword: {pwd}\n"
+        msgs.append(msg)
+    enqueue_mails(msgs)
+
+    results.sort(key=lambda r: r["row"])
+    return results
+
+
+def import_users(text_stream, on_chunk=None, cohort=None):
+    """
+    Importa los alumnos leyendo `text_stream` de a bloques, en la cohorte
+    `cohort` si se indica. Devuelve {"created", "skipped", "results"};
+    `on_chunk(results)` se llama tras cada bloque.
+    """
+    reader = csv.DictReader(text_stream, fieldnames=CSV_FIELDS, delimiter=';')
+    seen_dnis = set()
+    summary = {"created": 0, "skipped": 0, "results": []}
+    for rows in _chunks(reader, CHUNK_SIZE):
+        results = _import_chunk(rows, seen_dnis, cohort)
+        summary["created"] += sum(1 for r in results if r["status"] == "created")
+        summary["skipped"] += sum(1 for r in results if r["status"] == "skipped")
+        summary["results"].extend(results)
+        if on_chunk:
+            on_chunk(results)
+    return summary
+
+
+def start_import_job(app, text_stream, cohort=None):
+    """
+    Lanza la importación en un hilo y devuelve el id del documento de
+    `import_jobs` donde se va registrando el progreso.
+    """
+    job_id = mongo.db.import_jobs.insert_one({
+        "status": "running",
+        "created": 0,
+        "skipped": 0,
+        "processed": 0,
+        "results": [],
+        "started_at": datetime.utcnow()
+    }).inserted_id
+
+    def on_chunk(results):
+        mongo.db.import_jobs.update_one({"_id": job_id}, {
+            "$inc": {
+                "processed": len(results),
+                "created": sum(1 for r in results if r["status"] == "created"),
+                "skipped": sum(1 for r in results if r["status"] == "skipped")
+            },
+            "$push": {"results": {"$each": results}}
+        })
+
+    def run():
+        with app.app_context():
+            try:
+                import_users(text_stream, on_chunk, cohort)
+                status = {"status": "done"}
+            except Exception as e:
+                app.logger.exception("Error importando usuarios")
+                status = {"status": "error", "error": str(e)}
+            finally:
+                text_stream.close()
+            mongo.db.import_jobs.update_one(
+                {"_id": job_id},
+                {"$set": dict(status, finished_at=datetime.utcnow())}
+            )
+
+    threading.Thread(target=run, name=f"import-{job_id}", daemon=True).start()
+    return job_id
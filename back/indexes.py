@@ -0,0 +1,126 @@
+# indexes.py
+#
+# Registro de los índices que usan las consultas de la API. app.py los crea al
+# arrancar (create_index no hace nada si el índice ya existe) y el comando
+# `flask --app app indexes` informa cuáles faltan y cuáles no se usan.
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from extensions import mongo
+from idempotency import KEY_TTL
+from outbox import FINISHED_TTL
+
+# (colección, claves, opciones)
+INDEXES = [
+    # /login y todas las rutas con @jwt_required buscan por DNI
+    ("users", [("DNI", ASCENDING)], {"name": "DNI_unique", "unique": True}),
+    ("answers", [("user_id", ASCENDING)], {"name": "user_id"}),
+    ("answers", [("question_id", ASCENDING)], {"name": "question_id"}),
+    # a lo sumo un registro de ayudas por usuario y pregunta (use_help hace upsert)
+    ("question_helps", [("user_id", ASCENDING), ("question_id", ASCENDING)],
+     {"name": "user_question_unique", "unique": True}),
+    ("questions", [("unit_id", ASCENDING)], {"name": "unit_id"}),
+    # los workers de outbox.py buscan pendientes ordenados por próximo intento
+    ("mail_outbox", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {"name": "status_next_attempt"}),
+    # los mensajes enviados o fallidos (sólo ellos tienen finished_at) vencen solos
+    ("mail_outbox", [("finished_at", ASCENDING)],
+     {"name": "finished_at_ttl", "expireAfterSeconds": int(FINISHED_TTL.total_seconds())}),
+    ("exp_ledger", [("user_id", ASCENDING), ("question_id", ASCENDING)],
+     {"name": "user_question_unique", "unique": True}),
+    # rankings (ver leaderboard.py) y /users?sort=-exp
+    ("users", [("exp", DESCENDING), ("_id", ASCENDING)], {"name": "exp_rank"}),
+    ("unit_scores", [("unit_id", ASCENDING), ("user_id", ASCENDING)],
+     {"name": "unit_user_unique", "unique": True}),
+    ("unit_scores", [("unit_id", ASCENDING), ("exp", DESCENDING), ("user_id", ASCENDING)],
+     {"name": "unit_exp_rank"}),
+    # histograma de exp por ranking: la posición suma los buckets por encima
+    ("exp_buckets", [("board", ASCENDING), ("exp", ASCENDING)], {"name": "board_exp_unique", "unique": True}),
+    # consultas limitadas a una cohorte (ver cohorts.py): listados paginados
+    # por _id, ranking global, unidades y respuestas de la cohorte
+    ("users", [("cohort", ASCENDING), ("_id", ASCENDING)], {"name": "cohort_id"}),
+    ("users", [("cohort", ASCENDING), ("exp", DESCENDING), ("_id", ASCENDING)], {"name": "cohort_exp_rank"}),
+    ("units", [("cohort", ASCENDING)], {"name": "cohort"}),
+    ("answers", [("cohort", ASCENDING), ("_id", ASCENDING)], {"name": "cohort_id"}),
+    ("answers", [("cohort", ASCENDING), ("user_id", ASCENDING)], {"name": "cohort_user_id"}),
+    # /units/<id>/stats (ver question_stats.py)
+    ("question_stats", [("unit_id", ASCENDING)], {"name": "unit_id"}),
+    # un primer intento por alumno y pregunta (users de question_stats)
+    ("question_attempts", [("user_id", ASCENDING), ("question_id", ASCENDING)],
+     {"name": "user_question_unique", "unique": True}),
+    ("question_attempts", [("question_id", ASCENDING)], {"name": "question_id"}),
+    # las claves de idempotencia de POST /answers vencen solas (ver idempotency.py)
+    ("idempotency_keys", [("created_at", ASCENDING)],
+     {"name": "created_at_ttl", "expireAfterSeconds": int(KEY_TTL.total_seconds())}),
+]
+
+# Índices que se crean sólo si está activa la opción de configuración
+OPTIONAL_INDEXES = {
+    # una sola respuesta correcta por usuario y pregunta: las siguientes se rechazan
+    "ANSWERS_FIRST_CORRECT_WINS": [
+        ("answers", [("user_id", ASCENDING), ("question_id", ASCENDING)],
+         {"name": "first_correct_unique", "unique": True, "partialFilterExpression": {"correct": True}}),
+    ],
+}
+
+
+def registered_indexes(config=None):
+    """INDEXES más los de OPTIONAL_INDEXES activos en `config`."""
+    indexes = list(INDEXES)
+    for option, extra in OPTIONAL_INDEXES.items():
+        if config and config.get(option):
+            indexes.extend(extra)
+    return indexes
+
+
+def ensure_indexes(logger=None, config=None):
+    """Crea los índices del registro. Un índice que falla no impide crear el resto."""
+    created = []
+    for collection, keys, options in registered_indexes(config):
+        try:
+            created.append(mongo.db[collection].create_index(keys, **options))
+        except PyMongoError as e:
+            if logger:
+                logger.warning("No se pudo crear el índice %s.%s: %s", collection, options["name"], e)
+    return created
+
+
+def index_report(config=None):
+    """
+    Devuelve (faltantes, sin_uso): los índices del registro que no existen y los
+    índices existentes (salvo _id_) que no registran accesos según $indexStats.
+    """
+    indexes = registered_indexes(config)
+    missing = []
+    unused = []
+    for collection in sorted({c for c, _, _ in indexes}):
+        existing = {
+            tuple(info["key"]): name
+            for name, info in mongo.db[collection].index_information().items()
+        }
+        for coll, keys, options in indexes:
+            if coll == collection and tuple(keys) not in existing:
+                missing.append((collection, options["name"]))
+
+        for stats in mongo.db[collection].aggregate([{"$indexStats": {}}]):
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                unused.append((collection, stats["name"]))
+    return missing, unused
+
+
+@click.command("indexes")
+@click.option("--create", is_flag=True, help="Crea los índices que faltan.")
+@with_appcontext
+def indexes_command(create):
+    """Lista los índices que faltan o que no se usan."""
+    if create:
+        ensure_indexes(config=current_app.config)
+    missing, unused = index_report(current_app.config)
+    for collection, name in missing:
+        click.echo(f"falta:   {collection}.{name}")
+    for collection, name in unused:
+        click.echo(f"sin uso: {collection}.{name}")
+    if not missing and not unused:
+        click.echo("Todos los índices existen y se usan")
@@ -0,0 +1,121 @@
+# json_provider.py
+#
+# Proveedor JSON de Flask basado en orjson, con soporte nativo para los tipos
+# de BSON (ObjectId, Decimal128) y datetime, así los handlers pueden pasar los
+# documentos de MongoDB directo a jsonify sin convertir cada _id a mano.
+# Si orjson no está instalado se usa el proveedor por defecto de Flask con el
+# mismo manejo de tipos BSON.
+import time
+from decimal import Decimal
+
+import click
+from bson import Decimal128, ObjectId
+from flask import current_app
+from flask.cli import with_appcontext
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
+
+def bson_default(o):
+    """Tipos que ni orjson ni json saben serializar."""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, Decimal128):
+        return str(o.to_decimal())
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        try:
+            return bson_default(o)
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
+    def dumps_bytes(self, obj):
+        if orjson is None:
+            return self.dumps(obj).encode()
+        # OPT_NAIVE_UTC: los datetime de MongoDB son UTC sin zona horaria
+        return orjson.dumps(obj, default=bson_default,
+                            option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def stream_json_array(items):
+    """
+    Genera un array JSON elemento por elemento (para Response de Flask), sin
+    armar la lista completa en memoria. Se llama dentro del request: el
+    generador que devuelve puede consumirse después, fuera del contexto.
+    """
+    dumps = current_app.json.dumps_bytes
+
+    def generate():
+        yield b"["
+        first = True
+        for item in items:
+            yield (b"" if first else b",") + dumps(item)
+            first = False
+        yield b"]"
+
+    return generate()
+
+
+@click.command("json-benchmark")
+@click.option("--answers", default=5000, show_default=True, help="Respuestas a serializar.")
+@click.option("--users", default=200, show_default=True, help="Usuarios del informe a serializar.")
+@click.option("--rounds", default=5, show_default=True)
+@with_appcontext
+def json_benchmark_command(answers, users, rounds):
+    """Compara el jsonify anterior (json + str() a mano) con este proveedor."""
+    from extensions import mongo
+    from endpoints.epUsersReport import iter_user_reports
+
+    answer_docs = list(mongo.db.answers.find().limit(answers))
+    report = list(iter_user_reports(mongo.db.users.find().limit(users)))
+    default = DefaultJSONProvider(current_app)
+
+    def legacy_answers():
+        # lo que hacía GET /answers antes: convertir cada ObjectId y usar json
+        out = []
+        for a in answer_docs:
+            a = dict(a, _id=str(a["_id"]), question_id=str(a["question_id"]), user_id=str(a["user_id"]))
+            out.append(a)
+        return default.dumps(out)
+
+    def measure(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return (time.perf_counter() - start) / rounds * 1000
+
+    provider = current_app.json
+    click.echo(f"orjson: {'sí' if orjson else 'no instalado'}")
+    click.echo(f"/answers ({len(answer_docs)} docs): jsonify {measure(legacy_answers):.1f} ms, "
+               f"proveedor {measure(lambda: provider.dumps_bytes(answer_docs)):.1f} ms")
+    click.echo(f"/users/report ({len(report)} usuarios): jsonify "
+               f"{measure(lambda: default.dumps(report, default=BSONJSONProvider.default)):.1f} ms, "
+               f"proveedor {measure(lambda: provider.dumps_bytes(report)):.1f} ms")
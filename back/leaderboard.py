@@ -0,0 +1,261 @@
+# leaderboard.py
+#
+# Rankings por exp. El global se lee de `users` (exp por usuario) y el de
+# cada unidad de `unit_scores` ({unit_id, user_id, exp}), que se actualiza al
+# otorgar exp junto con el libro mayor (ver experience.record_exp). Ambos
+# tienen un índice (exp desc, id), así que el top-K y los vecinos de un
+# usuario son recorridos cortos del índice.
+#
+# Para la posición se mantiene un histograma en `exp_buckets`
+# ({board, exp, count}: cuántos usuarios del ranking `board` tienen esa exp),
+# que se mueve con $inc cada vez que cambia users.exp o unit_scores.exp (ver
+# move_buckets). La posición es 1 + la suma de los buckets por encima: el
+# costo depende de cuántos valores de exp distintos hay por encima, no de
+# cuántos usuarios, así que no crece con la cohorte (ver bench/rank_scaling.py).
+# `flask --app app rebuild-leaderboard` arma unit_scores y el histograma desde
+# cero.
+#
+# El orden es por exp descendente y, a igual exp, por id ascendente. La
+# posición ("rank") es la de competición: los empatados comparten posición
+# (1 + usuarios con más exp), así no hace falta contar dentro del empate.
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+
+from extensions import mongo
+from catalog import catalog
+
+
+class Board:
+    """Un ranking: colección, filtro fijo, campo con el id del usuario y clave en exp_buckets."""
+
+    def __init__(self, collection, base_filter, user_field, key):
+        self.collection = collection
+        self.base_filter = base_filter
+        self.user_field = user_field
+        self.key = key
+
+    def _find(self, extra, sort, limit):
+        query = dict(self.base_filter, **extra)
+        return list(mongo.db[self.collection].find(
+            query, {self.user_field: 1, "exp": 1}
+        ).sort(sort).limit(limit))
+
+    def _sum(self, exp_filter=None):
+        """Usuarios del ranking según el histograma, con exp en `exp_filter` (todos si no se pasa)."""
+        match = {"board": self.key}
+        if exp_filter is not None:
+            match["exp"] = exp_filter
+        rows = mongo.db.exp_buckets.aggregate([
+            {"$match": match},
+            {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+        ])
+        return next(rows, {}).get("count", 0)
+
+    def total(self):
+        return self._sum()
+
+    def entry(self, user_id):
+        return mongo.db[self.collection].find_one(
+            dict(self.base_filter, **{self.user_field: user_id}), {"exp": 1}
+        )
+
+    def top(self, k):
+        rows = self._find({}, [("exp", -1), (self.user_field, 1)], k)
+        ranked = []
+        for i, r in enumerate(rows):
+            exp = r.get("exp", 0)
+            rank = ranked[-1][0] if ranked and ranked[-1][2] == exp else i + 1
+            ranked.append((rank, r[self.user_field], exp))
+        return ranked
+
+    def around(self, user_id, exp, neighbours):
+        """
+        Posición del usuario, cuántos tienen menos exp y hasta `neighbours`
+        usuarios por encima y por debajo. Las posiciones salen del
+        histograma: la del usuario de los buckets por encima de su exp y las
+        de los vecinos de los buckets entre la suya y la de cada uno.
+        """
+        uf = self.user_field
+        rank = self._sum({"$gt": exp}) + 1
+        below_count = self._sum({"$lt": exp})
+
+        above = self._find(
+            {"$or": [{"exp": {"$gt": exp}}, {"exp": exp, uf: {"$lt": user_id}}]},
+            [("exp", 1), (uf, -1)], neighbours
+        )
+        below = self._find(
+            {"$or": [{"exp": {"$lt": exp}}, {"exp": exp, uf: {"$gt": user_id}}]},
+            [("exp", -1), (uf, 1)], neighbours
+        )
+        exps = [r.get("exp", 0) for r in above + below] + [exp]
+        window = {
+            b["exp"]: b["count"]
+            for b in mongo.db.exp_buckets.find(
+                {"board": self.key, "exp": {"$gte": min(exps), "$lte": max(exps)}}, {"exp": 1, "count": 1}
+            )
+        }
+
+        def rank_of(e):
+            if e >= exp:
+                return rank - sum(c for x, c in window.items() if exp < x <= e)
+            return rank + sum(c for x, c in window.items() if e < x <= exp)
+
+        above = [(rank_of(r.get("exp", 0)), r[uf], r.get("exp", 0)) for r in above][::-1]
+        below = [(rank_of(r.get("exp", 0)), r[uf], r.get("exp", 0)) for r in below]
+        return rank, below_count, above, below
+
+
+def user_boards(cohort):
+    """Claves en exp_buckets de los rankings globales en los que está un usuario de `cohort`."""
+    return ["users", f"users:{cohort}"] if cohort else ["users"]
+
+
+def unit_key(unit_id):
+    return f"unit:{unit_id}"
+
+
+def global_board(cohort=None):
+    """Ranking de todos los usuarios o, con `cohort`, de los de esa cohorte (ver cohorts.py)."""
+    if cohort:
+        return Board("users", {"cohort": cohort}, "_id", f"users:{cohort}")
+    return Board("users", {}, "_id", "users")
+
+
+def unit_board(unit_id):
+    return Board("unit_scores", {"unit_id": unit_id}, "user_id", unit_key(unit_id))
+
+
+def move_buckets(moves):
+    """
+    Aplica al histograma una lista de movimientos (claves, exp anterior, exp
+    nueva): None como exp anterior es un alta en esos rankings y como nueva,
+    una baja. Netea todo y escribe un $inc por bucket con un bulk_write.
+    """
+    net = {}
+    for keys, old, new in moves:
+        if old == new:
+            continue
+        for key in keys:
+            if old is not None:
+                net[(key, old)] = net.get((key, old), 0) - 1
+            if new is not None:
+                net[(key, new)] = net.get((key, new), 0) + 1
+    ops = [
+        UpdateOne({"board": key, "exp": exp}, {"$inc": {"count": n}}, upsert=True)
+        for (key, exp), n in net.items() if n
+    ]
+    if ops:
+        mongo.db.exp_buckets.bulk_write(ops, ordered=False)
+
+
+def user_moves(before, changes=None):
+    """
+    Movimientos de un usuario cuyo documento era `before` (con exp y cohort):
+    con `changes` (los campos que se le $set) pasa a su nueva exp y cohorte;
+    sin `changes`, se lo borró.
+    """
+    moves = [(user_boards(before.get("cohort")), before.get("exp", 0), None)]
+    if changes is not None:
+        cohort = changes.get("cohort", before.get("cohort"))
+        moves.append((user_boards(cohort), None, changes.get("exp", before.get("exp", 0))))
+    return moves
+
+
+def inc_user_exp(user_id, cohort, delta):
+    """
+    Suma `delta` a users.exp si el usuario está en `cohort` y devuelve el
+    movimiento de buckets ([] si no estaba).
+    """
+    before = mongo.db.users.find_one_and_update(
+        {"_id": user_id, "cohort": cohort}, {"$inc": {"exp": delta}}, projection={"exp": 1}
+    )
+    if before is None:
+        return []
+    return [(user_boards(cohort), before.get("exp", 0), before.get("exp", 0) + delta)]
+
+
+def inc_unit_score(user_id, unit_id, delta, upsert=True):
+    """Suma `delta` al puntaje del usuario en la unidad y devuelve el movimiento de buckets."""
+    before = mongo.db.unit_scores.find_one_and_update(
+        {"unit_id": unit_id, "user_id": user_id}, {"$inc": {"exp": delta}},
+        projection={"exp": 1}, upsert=upsert
+    )
+    if before is None:
+        return [([unit_key(unit_id)], None, delta)] if upsert else []
+    return [([unit_key(unit_id)], before.get("exp", 0), before.get("exp", 0) + delta)]
+
+
+def with_names(rows):
+    """Agrega nombre y apellido a filas (rank, user_id, exp) con una sola consulta."""
+    users = {
+        u["_id"]: u
+        for u in mongo.db.users.find({"_id": {"$in": [r[1] for r in rows]}}, {"name": 1, "lastname": 1})
+    }
+    return [
+        {
+            "rank": rank,
+            "user_id": str(user_id),
+            "name": users.get(user_id, {}).get("name"),
+            "lastname": users.get(user_id, {}).get("lastname"),
+            "exp": exp
+        }
+        for rank, user_id, exp in rows
+    ]
+
+
+def rebuild_unit_scores(log=None):
+    """Recalcula `unit_scores` desde el libro mayor (exp_ledger); devuelve cuántos puntajes escribió."""
+    questions = catalog.questions()
+    totals = {}
+    for row in mongo.db.exp_ledger.find({}, {"user_id": 1, "question_id": 1, "exp": 1}):
+        q = questions.get(row["question_id"])
+        if q:
+            key = (q.get("unit_id"), row["user_id"])
+            totals[key] = totals.get(key, 0) + row.get("exp", 0)
+
+    # los usuarios sin exp todavía (anteriores al libro mayor) entran al ranking global con 0
+    mongo.db.users.update_many({"exp": {"$exists": False}}, {"$set": {"exp": 0}})
+
+    docs = [{"unit_id": unit_id, "user_id": user_id, "exp": exp} for (unit_id, user_id), exp in totals.items()]
+    mongo.db.unit_scores.delete_many({})
+    for start in range(0, len(docs), 1000):
+        mongo.db.unit_scores.insert_many(docs[start:start + 1000], ordered=False)
+        if log:
+            log(f"{min(start + 1000, len(docs))}/{len(docs)} puntajes")
+    return len(docs)
+
+
+def rebuild_exp_buckets():
+    """
+    Rearma el histograma `exp_buckets` contando users y unit_scores por exp
+    (una agregación por colección); devuelve cuántos buckets escribió.
+    """
+    db = mongo.db
+    counts = {}
+    for row in db.users.aggregate([
+        {"$group": {"_id": {"cohort": "$cohort", "exp": "$exp"}, "count": {"$sum": 1}}}
+    ]):
+        for key in user_boards(row["_id"].get("cohort")):
+            bucket = (key, row["_id"].get("exp") or 0)
+            counts[bucket] = counts.get(bucket, 0) + row["count"]
+    for row in db.unit_scores.aggregate([
+        {"$group": {"_id": {"unit_id": "$unit_id", "exp": "$exp"}, "count": {"$sum": 1}}}
+    ]):
+        bucket = (unit_key(row["_id"].get("unit_id")), row["_id"].get("exp") or 0)
+        counts[bucket] = counts.get(bucket, 0) + row["count"]
+
+    docs = [{"board": key, "exp": exp, "count": count} for (key, exp), count in counts.items()]
+    db.exp_buckets.delete_many({})
+    if docs:
+        db.exp_buckets.insert_many(docs, ordered=False)
+    return len(docs)
+
+
+@click.command("rebuild-leaderboard")
+@with_appcontext
+def rebuild_leaderboard_command():
+    """Reconstruye los rankings (unit_scores, users.exp faltantes y el histograma) a partir del libro mayor de exp."""
+    total = rebuild_unit_scores(log=click.echo)
+    click.echo(f"{total} puntajes reconstruidos")
+    click.echo(f"{rebuild_exp_buckets()} buckets de exp")
@@ -0,0 +1,278 @@
+# monitoring.py
+#
+# Listeners de pymongo y métricas de la API. Los listeners se registran al
+# crear el MongoClient (ver create_app en app.py):
+# - PoolMonitor: saturación del pool de conexiones, para /health/ready.
+# - CommandMonitor: comandos enviados a MongoDB y su duración, por request.
+# init_app() mide cada request (latencia, tamaños, comandos de MongoDB por
+# ruta), agrega el header Server-Timing y publica todo en /metrics en formato
+# de texto de Prometheus. Las métricas son por proceso worker.
+import threading
+import time
+
+from flask import g, request, Response
+from pymongo import monitoring
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Cuenta conexiones abiertas, en uso y requests esperando una conexión."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self.max_pool_size = None
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def pool_created(self, event):
+        self.max_pool_size = event.options.get("maxPoolSize", self.max_pool_size)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def stats(self):
+        with self._lock:
+            saturation = self.in_use / self.max_pool_size if self.max_pool_size else None
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+                "max_pool_size": self.max_pool_size,
+                "saturation": saturation
+            }
+
+
+pool_monitor = PoolMonitor()
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """
+    Cuenta los comandos enviados a MongoDB (total y por tipo) y, si hay un
+    request en curso en el hilo, cuántos hizo y cuánto tiempo esperó a MongoDB.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.commands = {}
+        self.failures = 0
+
+    def begin_request(self):
+        self._local.request = {"count": 0, "seconds": 0.0}
+
+    def end_request(self):
+        stats = getattr(self._local, "request", None)
+        self._local.request = None
+        return stats or {"count": 0, "seconds": 0.0}
+
+    def _record(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            total = self.commands.setdefault(event.command_name, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+            if failed:
+                self.failures += 1
+        # pymongo (sync) notifica en el hilo que hizo la consulta, el del request
+        stats = getattr(self._local, "request", None)
+        if stats is not None:
+            stats["count"] += 1
+            stats["seconds"] += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+
+command_monitor = CommandMonitor()
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (n, _escape(v)) for n, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append("%s_bucket%s %d" % (self.name, _labels(self.label_names, labels, ("le", bound)), count))
+                lines.append("%s_bucket%s %d" % (self.name, _labels(self.label_names, labels, ("le", "+Inf")), series["count"]))
+                lines.append("%s_sum%s %s" % (self.name, _labels(self.label_names, labels), series["sum"]))
+                lines.append("%s_count%s %d" % (self.name, _labels(self.label_names, labels), series["count"]))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append("%s%s %s" % (self.name, _labels(self.label_names, labels), value))
+        return lines
+
+
+ROUTE_LABELS = ("method", "route")
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Latencia de los requests por ruta.", ROUTE_LABELS, LATENCY_BUCKETS)
+request_size = Histogram(
+    "http_request_size_bytes", "Tamaño del cuerpo de los requests por ruta.", ROUTE_LABELS, SIZE_BUCKETS)
+response_size = Histogram(
+    "http_response_size_bytes", "Tamaño de las respuestas por ruta (sin contar las streameadas).", ROUTE_LABELS, SIZE_BUCKETS)
+request_mongo_commands = Histogram(
+    "http_request_mongo_commands", "Comandos enviados a MongoDB por request.", ROUTE_LABELS, QUERY_BUCKETS)
+request_mongo_seconds = Histogram(
+    "http_request_mongo_seconds", "Tiempo esperando a MongoDB por request.", ROUTE_LABELS, LATENCY_BUCKETS)
+requests_total = Counter(
+    "http_requests_total", "Requests atendidos por ruta y código de estado.", ROUTE_LABELS + ("status",))
+
+REQUEST_METRICS = (request_latency, request_size, response_size, request_mongo_commands, request_mongo_seconds, requests_total)
+
+
+def render_metrics():
+    """Todas las métricas en formato de texto de Prometheus."""
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+
+    with command_monitor._lock:
+        commands = sorted(command_monitor.commands.items())
+        failures = command_monitor.failures
+    lines += ["# HELP mongo_commands_total Comandos enviados a MongoDB por tipo.", "# TYPE mongo_commands_total counter"]
+    lines += ['mongo_commands_total{command="%s"} %d' % (_escape(name), c[0]) for name, c in commands]
+    lines += ["# HELP mongo_command_seconds_total Tiempo en MongoDB por tipo de comando.", "# TYPE mongo_command_seconds_total counter"]
+    lines += ['mongo_command_seconds_total{command="%s"} %s' % (_escape(name), c[1]) for name, c in commands]
+    lines += ["# HELP mongo_command_failures_total Comandos de MongoDB que fallaron.", "# TYPE mongo_command_failures_total counter"]
+    lines.append("mongo_command_failures_total %d" % failures)
+
+    pool = pool_monitor.stats()
+    for name in ("open", "in_use", "waiting"):
+        lines += ["# TYPE mongo_pool_%s gauge" % name, "mongo_pool_%s %d" % (name, pool[name])]
+    lines += ["# TYPE mongo_pool_checkout_failures_total counter",
+              "mongo_pool_checkout_failures_total %d" % pool["checkout_failures"]]
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Mide todos los requests de la app y registra GET /metrics."""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        command_monitor.begin_request()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        mongo = command_monitor.end_request()
+
+        # se agrupa por la regla de la ruta (/users/<user_id>), no por la URL
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        labels = (request.method, route)
+        request_latency.observe(labels, elapsed)
+        request_size.observe(labels, request.content_length or 0)
+        # en las respuestas streameadas el tamaño no se conoce y la latencia
+        # llega hasta que empieza el stream
+        if response.content_length is not None:
+            response_size.observe(labels, response.content_length)
+        request_mongo_commands.observe(labels, mongo["count"])
+        request_mongo_seconds.observe(labels, mongo["seconds"])
+        requests_total.inc(labels + (response.status_code,))
+
+        response.headers.add(
+            "Server-Timing",
+            'app;dur=%.1f, mongo;dur=%.1f;desc="%d commands"' % (elapsed * 1000, mongo["seconds"] * 1000, mongo["count"])
+        )
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
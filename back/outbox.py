@@ -0,0 +1,174 @@
+# outbox.py
+#
+# Bandeja de salida de correos. Los endpoints no envían mails dentro del
+# request: guardan el mensaje ya armado en la colección `mail_outbox` y
+# responden enseguida. Un grupo de hilos en segundo plano toma los mensajes
+# pendientes por lotes, los envía reutilizando una sola conexión SMTP por lote
+# y reintenta con espera exponencial los que fallan.
+#
+# Los mensajes pueden llevar contraseñas en texto plano (alta de usuarios), así
+# que al terminar (enviado o fallido definitivo) se borran body y html y el
+# documento vence solo a los FINISHED_TTL por un índice TTL sobre finished_at
+# (ver indexes.py).
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from pymongo import ReturnDocument
+
+from extensions import mongo
+
+MAX_ATTEMPTS = 5
+# espera antes del reintento n: BACKOFF_BASE * 2**(n-1) segundos
+BACKOFF_BASE = 30
+# un mensaje tomado por un worker que no terminó vuelve a la cola pasado este tiempo
+CLAIM_TIMEOUT = timedelta(minutes=10)
+# cuánto se conservan los mensajes terminados (ya sin contenido)
+FINISHED_TTL = timedelta(days=7)
+# se borra al terminar: puede contener credenciales
+CONTENT_FIELDS = {"body": "", "html": ""}
+
+
+def _outbox_doc(msg, now):
+    return {
+        "subject": msg.subject,
+        "recipients": list(msg.recipients),
+        "sender": msg.sender,
+        "body": msg.body,
+        "html": msg.html,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now
+    }
+
+
+def enqueue_mail(msg):
+    """Guarda un flask_mail.Message en la bandeja de salida para enviarlo luego."""
+    return mongo.db.mail_outbox.insert_one(_outbox_doc(msg, datetime.utcnow())).inserted_id
+
+
+def enqueue_mails(msgs):
+    """Como enqueue_mail pero con un solo insert_many para muchos mensajes."""
+    now = datetime.utcnow()
+    docs = [_outbox_doc(msg, now) for msg in msgs]
+    if docs:
+        mongo.db.mail_outbox.insert_many(docs, ordered=False)
+
+
+def _claim(worker_id):
+    """Marca como 'sending' el próximo mensaje listo para enviar y lo devuelve."""
+    now = datetime.utcnow()
+    return mongo.db.mail_outbox.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "claimed_at": {"$lt": now - CLAIM_TIMEOUT}}
+        ]},
+        {"$set": {"status": "sending", "claimed_at": now, "worker": worker_id}},
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _to_message(doc):
+    return Message(
+        subject=doc["subject"],
+        recipients=doc["recipients"],
+        body=doc.get("body"),
+        html=doc.get("html"),
+        sender=doc.get("sender")
+    )
+
+
+def _mark_failed(doc, error):
+    attempts = doc.get("attempts", 0) + 1
+    update = {"attempts": attempts, "last_error": str(error)}
+    if attempts >= MAX_ATTEMPTS:
+        update["status"] = "failed"
+        update["finished_at"] = datetime.utcnow()
+        mongo.db.mail_outbox.update_one({"_id": doc["_id"]}, {"$set": update, "$unset": CONTENT_FIELDS})
+        return
+    update["status"] = "pending"
+    update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=BACKOFF_BASE * 2 ** (attempts - 1))
+    mongo.db.mail_outbox.update_one({"_id": doc["_id"]}, {"$set": update})
+
+
+def drain_once(batch_size=20, worker_id="cli"):
+    """
+    Envía hasta `batch_size` mensajes pendientes sobre una misma conexión SMTP.
+    Devuelve (enviados, fallidos). Requiere un contexto de aplicación.
+    """
+    batch = []
+    while len(batch) < batch_size:
+        doc = _claim(worker_id)
+        if not doc:
+            break
+        batch.append(doc)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    try:
+        with current_app.extensions['mail'].connect() as conn:
+            for doc in batch:
+                try:
+                    conn.send(_to_message(doc))
+                except Exception as e:
+                    _mark_failed(doc, e)
+                    failed += 1
+                    continue
+                now = datetime.utcnow()
+                mongo.db.mail_outbox.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {"status": "sent", "sent_at": now, "finished_at": now}, "$unset": CONTENT_FIELDS}
+                )
+                sent += 1
+    except Exception as e:
+        # no se pudo abrir la conexión: todo el lote vuelve a la cola
+        for doc in batch[sent + failed:]:
+            _mark_failed(doc, e)
+            failed += 1
+    return sent, failed
+
+
+def _worker_loop(app, worker_id, batch_size, poll_interval, stop_event):
+    with app.app_context():
+        while not stop_event.is_set():
+            try:
+                sent, failed = drain_once(batch_size, worker_id)
+            except Exception:
+                app.logger.exception("Error en el worker de la bandeja de salida")
+                sent = failed = 0
+            if not sent and not failed:
+                stop_event.wait(poll_interval)
+
+
+def start_outbox_workers(app, workers=1, batch_size=20, poll_interval=2.0):
+    """Lanza `workers` hilos daemon que vacían la bandeja de salida."""
+    stop_event = threading.Event()
+    for i in range(workers):
+        threading.Thread(
+            target=_worker_loop,
+            args=(app, f"worker-{i}", batch_size, poll_interval, stop_event),
+            name=f"mail-outbox-{i}",
+            daemon=True
+        ).start()
+    return stop_event
+
+
+@click.command("outbox-drain")
+@click.option("--batch-size", default=20, show_default=True, help="Mensajes por conexión SMTP.")
+@with_appcontext
+def outbox_drain_command(batch_size):
+    """Envía todos los mensajes pendientes de la bandeja de salida y termina."""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = drain_once(batch_size)
+        if not sent and not failed:
+            break
+        total_sent += sent
+        total_failed += failed
+    click.echo(f"{total_sent} enviados, {total_failed} fallidos")
@@ -0,0 +1,74 @@
+# pagination.py
+#
+# Paginado por cursor (keyset sobre _id) y proyección de campos para los
+# endpoints de listado. Sin `limit` los endpoints siguen devolviendo la lista
+# completa; con `limit` devuelven {"items": [...], "next": token} y el token
+# se pasa como `after` para pedir la página siguiente.
+import base64
+import binascii
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+MAX_LIMIT = 1000
+
+
+def encode_cursor(oid):
+    """Token opaco a partir del _id del último elemento de la página."""
+    return base64.urlsafe_b64encode(oid.binary).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return ObjectId(raw)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise ValueError("cursor inválido")
+
+
+def parse_fields(arg, allowed):
+    """
+    Convierte `fields=a,b,c` en una proyección de MongoDB. Devuelve None si no
+    se pidió ningún campo; lanza ValueError si alguno no está en `allowed`.
+    """
+    if not arg:
+        return None
+    fields = [f.strip() for f in arg.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+    return {f: 1 for f in fields}
+
+
+def parse_page(args):
+    """
+    Lee `limit` y `after` de los parámetros de consulta.
+    Devuelve (limit o None, ObjectId o None); lanza ValueError si son inválidos.
+    """
+    limit = args.get("limit")
+    after = args.get("after")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit debe ser un entero")
+        if not 0 < limit <= MAX_LIMIT:
+            raise ValueError(f"limit debe estar entre 1 y {MAX_LIMIT}")
+    if after is not None:
+        if limit is None:
+            raise ValueError("after requiere limit")
+        after = decode_cursor(after)
+    return limit, after
+
+
+def find_page(collection, query, projection, limit, after):
+    """
+    Ejecuta la consulta paginada por _id. Devuelve (documentos, próximo token);
+    el token es None en la última página.
+    """
+    if after is not None:
+        query = {"$and": [query, {"_id": {"$gt": after}}]}
+    cursor = collection.find(query, projection).sort("_id", 1).limit(limit + 1)
+    docs = list(cursor)
+    next_token = encode_cursor(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_token
@@ -0,0 +1,141 @@
+# passwords.py
+#
+# Hasheo y verificación de contraseñas fuera del hilo del request.
+# generate_password_hash/check_password_hash son deliberadamente lentos, así que
+# se ejecutan en un pool de procesos acotado. Si hay demasiadas operaciones
+# encoladas (p.ej. un curso entero haciendo login a la vez) se rechazan con
+# HashingBusy en lugar de dejar todos los hilos del servidor bloqueados.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from functools import partial
+
+import click
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Valores por defecto; app.py los pisa con configure()
+settings = {
+    # método de werkzeug, p.ej. "scrypt:32768:8:1" o "pbkdf2:sha256:600000"
+    "method": "scrypt",
+    "workers": os.cpu_count() or 1,
+    # operaciones en curso + en cola admitidas antes de rechazar
+    "max_queue": (os.cpu_count() or 1) * 8,
+    # segundos que espera un request por su resultado
+    "timeout": 10.0
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+_stats = {"in_flight": 0, "completed": 0, "rejected": 0}
+_stats_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """El pool de hasheo está saturado; el cliente debería reintentar."""
+
+
+def configure(method=None, workers=None, max_queue=None, timeout=None):
+    global _pool, _slots
+    for key, value in (("method", method), ("workers", workers),
+                       ("max_queue", max_queue), ("timeout", timeout)):
+        if value:
+            settings[key] = value
+    with _pool_lock:
+        # el pool anterior se cierra (sus procesos terminan); el próximo uso crea otro
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        _slots = None
+
+
+def _get_pool():
+    # Se crea en el primer uso, así cada proceso worker (post-fork) tiene el suyo
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: no se hace fork de un proceso con hilos de PyMongo y del outbox corriendo
+            _pool = ProcessPoolExecutor(
+                max_workers=settings["workers"],
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+            _slots = threading.BoundedSemaphore(settings["max_queue"])
+        return _pool, _slots
+
+
+def _on_done(slots, _future):
+    slots.release()
+    with _stats_lock:
+        _stats["in_flight"] -= 1
+        _stats["completed"] += 1
+
+
+def _run(fn, *args):
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise HashingBusy()
+    with _stats_lock:
+        _stats["in_flight"] += 1
+    future = pool.submit(fn, *args)
+    future.add_done_callback(partial(_on_done, slots))
+    try:
+        return future.result(timeout=settings["timeout"])
+    except TimeoutError:
+        raise HashingBusy()
+
+
+def hash_password(password):
+    """generate_password_hash con el método configurado, ejecutado en el pool."""
+    return _run(generate_password_hash, password, settings["method"])
+
+
+def check_password(pwhash, password):
+    """check_password_hash ejecutado en el pool."""
+    return _run(check_password_hash, pwhash, password)
+
+
+def hash_many(passwords):
+    """
+    Devuelve los hashes de `passwords`, en el mismo orden, calculados en
+    paralelo. Pensado para lotes (importación de CSV): no pasa por el control
+    de admisión de los requests.
+    """
+    passwords = list(passwords)
+    hasher = partial(generate_password_hash, method=settings["method"])
+    if len(passwords) < 2:
+        return [hasher(p) for p in passwords]
+    pool, _ = _get_pool()
+    chunksize = max(1, len(passwords) // (settings["workers"] * 4))
+    return list(pool.map(hasher, passwords, chunksize=chunksize))
+
+
+def stats():
+    """Estado del pool: operaciones en curso/en cola, completadas y rechazadas."""
+    with _stats_lock:
+        return dict(_stats, workers=settings["workers"], max_queue=settings["max_queue"],
+                    method=settings["method"])
+
+
+@click.command("hash-benchmark")
+@click.option("--logins", default=200, show_default=True, help="Cantidad de verificaciones.")
+@with_appcontext
+def hash_benchmark_command(logins):
+    """Mide cuántos logins (check_password_hash) por segundo soporta el pool."""
+    pwhash = generate_password_hash("contraseña-de-prueba", settings["method"])
+    pool, _ = _get_pool()
+    # calentamos el pool para no medir el arranque de los procesos
+    list(pool.map(check_password_hash, [pwhash] * settings["workers"], ["x"] * settings["workers"]))
+
+    start = time.perf_counter()
+    list(pool.map(check_password_hash, [pwhash] * logins, ["contraseña-de-prueba"] * logins))
+    elapsed = time.perf_counter() - start
+
+    per_second = logins / elapsed
+    click.echo(f"método: {settings['method']}  workers: {settings['workers']}")
+    click.echo(f"{logins} logins en {elapsed:.2f}s: {per_second:.1f} logins/s, "
+               f"{per_second / settings['workers']:.1f} logins/s por núcleo")
@@ -0,0 +1,110 @@
+# progress.py
+#
+# Progreso materializado: un documento por usuario en `user_progress` con las
+# preguntas resueltas agrupadas por unidad,
+#   {_id: user_id, units: {"<unit_id>": [question_id, ...]}}
+# Se actualiza junto con la exp cuando una respuesta es correcta (ver
+# experience.exp_updates), así /user-progress lo lee con una sola consulta en
+# lugar de corregir todas las respuestas del usuario. El avance por unidad
+# (resueltas / total) se calcula al leer con el catálogo en memoria, así no
+# queda desactualizado cuando se agregan o borran preguntas.
+import click
+from flask.cli import with_appcontext
+from pymongo import ReplaceOne, UpdateOne
+
+from extensions import mongo
+from catalog import catalog
+from grading import grade
+
+
+def progress_update(user_id, question):
+    """Actualización (colección, filtro, update, upsert) que marca `question` como resuelta."""
+    return (
+        "user_progress",
+        {"_id": user_id},
+        {"$addToSet": {f"units.{question.get('unit_id')}": question["_id"]}},
+        True
+    )
+
+
+def progress_bulk_ops(solved):
+    """Como progress_update para una lista de (user_id, question), con un UpdateOne por usuario."""
+    by_user = {}
+    for user_id, question in solved:
+        units = by_user.setdefault(user_id, {})
+        units.setdefault(f"units.{question.get('unit_id')}", []).append(question["_id"])
+    return [
+        UpdateOne({"_id": uid}, {"$addToSet": {k: {"$each": v} for k, v in units.items()}}, upsert=True)
+        for uid, units in by_user.items()
+    ]
+
+
+def progress_pipeline(dni):
+    """Usuario por DNI junto con su progreso, en una sola ida a MongoDB."""
+    return [
+        {"$match": {"DNI": dni}},
+        {"$limit": 1},
+        {"$lookup": {"from": "user_progress", "localField": "_id", "foreignField": "_id", "as": "progress"}},
+        {"$project": {"units": {"$ifNull": [{"$arrayElemAt": ["$progress.units", 0]}, {}]}}}
+    ]
+
+
+def summarize(units, detail=False):
+    """
+    Arma la respuesta de /user-progress a partir de `units` guardado: por defecto
+    {unit_id: [question_id, ...]}; con detail, {unit_id: {solved, total, ratio}}.
+    Las preguntas se agrupan por su unidad actual y se omiten las borradas.
+    """
+    questions = catalog.questions()
+    by_unit = {}
+    for question_ids in units.values():
+        for question_id in question_ids:
+            q = questions.get(question_id)
+            if q:
+                by_unit.setdefault(q.get("unit_id"), []).append(str(question_id))
+
+    if not detail:
+        return {str(unit_id): solved for unit_id, solved in by_unit.items()}
+    out = {}
+    for unit_id, solved in by_unit.items():
+        total = len(catalog.questions_by_unit(unit_id))
+        out[str(unit_id)] = {"solved": solved, "total": total, "ratio": len(solved) / total if total else 0.0}
+    return out
+
+
+def _rebuild_chunk(user_ids, questions):
+    db = mongo.db
+    answers = list(db.answers.find(
+        {"user_id": {"$in": user_ids}},
+        {"user_id": 1, "question_id": 1, "selectedOption": 1, "body": 1}
+    ))
+    units = {uid: {} for uid in user_ids}
+    for ans, correct in zip(answers, grade(answers, questions)):
+        if correct:
+            q = questions[ans["question_id"]]
+            solved = units[ans["user_id"]].setdefault(str(q.get("unit_id")), [])
+            if q["_id"] not in solved:
+                solved.append(q["_id"])
+    db.user_progress.bulk_write([
+        ReplaceOne({"_id": uid}, {"units": u}, upsert=True) for uid, u in units.items()
+    ], ordered=False)
+
+
+def rebuild_progress(chunk_size=500, log=None):
+    """Recalcula `user_progress` de todos los usuarios desde sus respuestas; devuelve cuántos procesó."""
+    questions = catalog.questions()
+    user_ids = [u["_id"] for u in mongo.db.users.find({}, {"_id": 1})]
+    for start in range(0, len(user_ids), chunk_size):
+        _rebuild_chunk(user_ids[start:start + chunk_size], questions)
+        if log:
+            log(f"{min(start + chunk_size, len(user_ids))}/{len(user_ids)} usuarios")
+    return len(user_ids)
+
+
+@click.command("rebuild-progress")
+@click.option("--chunk-size", default=500, show_default=True, help="Usuarios por grupo.")
+@with_appcontext
+def rebuild_progress_command(chunk_size):
+    """Reconstruye el progreso materializado (user_progress) a partir de las respuestas."""
+    total = rebuild_progress(chunk_size=chunk_size, log=click.echo)
+    click.echo(f"{total} usuarios reconstruidos")
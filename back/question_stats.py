@@ -0,0 +1,247 @@
+# question_stats.py
+#
+# Contadores de dificultad por pregunta en `question_stats`:
+#   {_id: question_id, unit_id, attempts, correct, exp_awarded, users, hint1, hint2}
+# Se incrementan con $inc al responder (attempts, correct, exp_awarded) y al
+# pedir una ayuda por primera vez (hint1/hint2: alumnos que la pidieron), así
+# /questions/<id>/stats y /units/<id>/stats no recorren respuestas ni ayudas.
+# `users` son los alumnos que intentaron la pregunta o pidieron una ayuda: cada
+# par (alumno, pregunta) se marca una sola vez en `question_attempts` (índice
+# único, ver indexes.py) y suma 1 la primera vez, responda o pida ayuda, así
+# hint1/hint2 nunca superan a users. Al borrar un usuario o una respuesta se
+# descuenta lo suyo (ver user_stats_ops y cleanup.py). El comando
+# `flask --app app backfill-question-stats` los arma desde el historial.
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from extensions import mongo
+from catalog import catalog
+
+COUNTERS = ("attempts", "correct", "exp_awarded", "users", "hint1", "hint2")
+
+
+def mark_attempt(user_id, question_id):
+    """
+    Marca en `question_attempts` que el alumno intentó la pregunta (o pidió
+    una ayuda). Devuelve True si es la primera vez, es decir si cuenta en `users`.
+    """
+    try:
+        result = mongo.db.question_attempts.update_one(
+            {"user_id": user_id, "question_id": question_id},
+            {"$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # otro request insertó el mismo par a la vez: ese cuenta
+        return False
+    return result.upserted_id is not None
+
+
+def mark_attempts(pairs):
+    """
+    Como mark_attempt para una lista de pares (user_id, question_id) sin
+    repetidos, en un solo bulk_write. Devuelve el set de pares que son nuevos.
+    """
+    if not pairs:
+        return set()
+    ops = [
+        UpdateOne({"user_id": uid, "question_id": qid},
+                  {"$setOnInsert": {"created_at": datetime.utcnow()}}, upsert=True)
+        for uid, qid in pairs
+    ]
+    try:
+        upserted = mongo.db.question_attempts.bulk_write(ops, ordered=False).upserted_ids
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            if err.get("code") != 11000:
+                raise
+        upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+    return {pairs[i] for i in upserted}
+
+
+def attempt_update(question, correct, exp_awarded, first_attempt):
+    """Actualización (colección, filtro, update, upsert) que registra un intento de responder `question`."""
+    return (
+        "question_stats",
+        {"_id": question["_id"]},
+        {"$inc": {"attempts": 1, "correct": int(bool(correct)), "exp_awarded": exp_awarded,
+                  "users": int(bool(first_attempt))},
+         "$set": {"unit_id": question.get("unit_id")}},
+        True
+    )
+
+
+def attempt_bulk_ops(attempts):
+    """Como attempt_update para una lista de (question, correct, exp, first_attempt), un UpdateOne por pregunta."""
+    by_question = {}
+    for question, correct, exp_awarded, first_attempt in attempts:
+        entry = by_question.setdefault(question["_id"], [question, 0, 0, 0, 0])
+        entry[1] += 1
+        entry[2] += int(bool(correct))
+        entry[3] += exp_awarded
+        entry[4] += int(bool(first_attempt))
+    return [
+        UpdateOne({"_id": qid},
+                  {"$inc": {"attempts": n, "correct": ok, "exp_awarded": exp, "users": users},
+                   "$set": {"unit_id": question.get("unit_id")}},
+                  upsert=True)
+        for qid, (question, n, ok, exp, users) in by_question.items()
+    ]
+
+
+def record_attempt(question, correct, exp_awarded, first_attempt):
+    collection, filter_, update, upsert = attempt_update(question, correct, exp_awarded, first_attempt)
+    mongo.db[collection].update_one(filter_, update, upsert=upsert)
+
+
+def record_help(question, help_number, first_attempt):
+    mongo.db.question_stats.update_one(
+        {"_id": question["_id"]},
+        {"$inc": {f"hint{help_number}": 1, "users": int(bool(first_attempt))},
+         "$set": {"unit_id": question.get("unit_id")}},
+        upsert=True
+    )
+
+
+def _decrements(collection, match, group):
+    """UpdateOne con $inc negativos a partir de una agregación agrupada por question_id."""
+    ops = []
+    for row in mongo.db[collection].aggregate([{"$match": match}, {"$group": dict(group, _id="$question_id")}]):
+        inc = {field: -value for field, value in row.items() if field != "_id" and value}
+        if inc:
+            ops.append(UpdateOne({"_id": row["_id"]}, {"$inc": inc}))
+    return ops
+
+
+def user_stats_ops(user_id):
+    """
+    UpdateOne que descuentan de question_stats lo aportado por un usuario
+    (intentos, aciertos, exp, si contaba en users y sus ayudas). Se arman
+    antes de borrar sus filas (ver cleanup.cascade_delete_user).
+    """
+    match = {"user_id": user_id}
+    return (
+        _decrements("answers", match, {"attempts": {"$sum": 1},
+                                       "correct": {"$sum": {"$cond": ["$correct", 1, 0]}}})
+        + _decrements("exp_ledger", match, {"exp_awarded": {"$sum": "$exp"}})
+        + _decrements("question_attempts", match, {"users": {"$sum": 1}})
+        + _decrements("question_helps", match, {
+            "hint1": {"$sum": {"$cond": [{"$eq": ["$usedHelp1", True]}, 1, 0]}},
+            "hint2": {"$sum": {"$cond": [{"$eq": ["$usedHelp2", True]}, 1, 0]}}
+        })
+    )
+
+
+def record_answer_deleted(answer):
+    """Descuenta de question_stats el intento de una respuesta borrada."""
+    mongo.db.question_stats.update_one(
+        {"_id": answer["question_id"]},
+        {"$inc": {"attempts": -1, "correct": -int(bool(answer.get("correct")))}}
+    )
+
+
+def _rate(part, total):
+    return round(part / total, 4) if total else None
+
+
+def _summary(question_id, stats):
+    """
+    Contadores y tasas de una pregunta. correct_rate es por intento;
+    hint1_rate/hint2_rate son alumnos que pidieron la ayuda sobre alumnos que
+    intentaron la pregunta o pidieron alguna ayuda. Se acotan a 1 por los
+    datos de antes de question_attempts (hasta correr el backfill).
+    """
+    stats = stats or {}
+    counts = {c: stats.get(c, 0) for c in COUNTERS}
+    hint_rates = {
+        f"hint{h}_rate": min(1.0, _rate(counts[f"hint{h}"], counts["users"]))
+        if counts["users"] else None
+        for h in (1, 2)
+    }
+    return {
+        "question_id": str(question_id),
+        **counts,
+        "correct_rate": _rate(counts["correct"], counts["attempts"]),
+        **hint_rates,
+        "avg_exp": _rate(counts["exp_awarded"], counts["correct"])
+    }
+
+
+def question_stats(question_id):
+    return _summary(question_id, mongo.db.question_stats.find_one({"_id": question_id}))
+
+
+def unit_stats(unit_id):
+    """
+    Totales de la unidad y las estadísticas de cada una de sus preguntas, de
+    la más difícil (menor tasa de acierto) a la más fácil.
+    """
+    stored = {s["_id"]: s for s in mongo.db.question_stats.find({"unit_id": unit_id})}
+    questions = [_summary(q["_id"], stored.get(q["_id"])) for q in catalog.questions_by_unit(unit_id)]
+    questions.sort(key=lambda s: (s["correct_rate"] is None, s["correct_rate"] or 0))
+    totals = _summary(unit_id, {c: sum(s[c] for s in questions) for c in COUNTERS})
+    del totals["question_id"]
+    return {"unit_id": str(unit_id), **totals, "questions": questions}
+
+
+def backfill_question_stats():
+    """
+    Rearma `question_stats` desde el historial con agregaciones que escriben
+    con $merge: intentos desde `answers`, aciertos y exp desde `exp_ledger`,
+    ayudas desde `question_helps` y alumnos desde `question_attempts`, que se
+    completa antes con los pares (alumno, pregunta) de respuestas y ayudas.
+    Devuelve cuántas preguntas quedaron con contadores.
+    """
+    db = mongo.db
+    db.question_stats.delete_many({})
+    # un documento por pregunta existente; lo de preguntas borradas se descarta
+    db.questions.aggregate([
+        {"$project": {"unit_id": 1}},
+        {"$merge": {"into": "question_stats", "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+    ])
+    merge = {"$merge": {"into": "question_stats", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    db.answers.aggregate([
+        {"$group": {"_id": "$question_id", "attempts": {"$sum": 1}}},
+        merge
+    ])
+    # los próximos intentos o ayudas de estos alumnos no vuelven a contar en `users`
+    for collection in ("answers", "question_helps"):
+        db[collection].aggregate([
+            {"$group": {"_id": {"user_id": "$user_id", "question_id": "$question_id"}}},
+            {"$project": {"_id": 0, "user_id": "$_id.user_id", "question_id": "$_id.question_id",
+                          "created_at": "$$NOW"}},
+            {"$merge": {"into": "question_attempts", "on": ["user_id", "question_id"],
+                        "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+        ])
+    # marcas `attempted` que se guardaban en question_helps antes de question_attempts
+    db.question_helps.delete_many({"attempted": True, "usedHelp1": {"$ne": True}, "usedHelp2": {"$ne": True}})
+    db.question_helps.update_many({"attempted": {"$exists": True}}, {"$unset": {"attempted": ""}})
+    db.question_attempts.aggregate([
+        {"$group": {"_id": "$question_id", "users": {"$sum": 1}}},
+        merge
+    ])
+    db.exp_ledger.aggregate([
+        {"$group": {"_id": "$question_id", "correct": {"$sum": "$correct"}, "exp_awarded": {"$sum": "$exp"}}},
+        merge
+    ])
+    db.question_helps.aggregate([
+        {"$group": {
+            "_id": "$question_id",
+            "hint1": {"$sum": {"$cond": [{"$eq": ["$usedHelp1", True]}, 1, 0]}},
+            "hint2": {"$sum": {"$cond": [{"$eq": ["$usedHelp2", True]}, 1, 0]}}
+        }},
+        merge
+    ])
+    return db.question_stats.count_documents({})
+
+
+@click.command("backfill-question-stats")
+@with_appcontext
+def backfill_question_stats_command():
+    """Rearma los contadores de dificultad por pregunta desde respuestas, libro mayor y ayudas."""
+    total = backfill_question_stats()
+    click.echo(f"{total} preguntas con estadísticas")
@@ -0,0 +1,114 @@
+"""
+GET /users/report con más de un lote de usuarios (REPORT_BATCH_SIZE), sobre
+mongomock como bench/harness.py --mongomock.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("flask")
+flask_pymongo = pytest.importorskip("flask_pymongo")
+mongomock = pytest.importorskip("mongomock")
+from bson import ObjectId  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+USERS = 450
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("MONGO_URI", "mongodb://localhost:27017/trp_test")
+    monkeypatch.setenv("SECRET_KEY", "test")
+    monkeypatch.setenv("MAIL_OUTBOX_WORKERS", "0")
+    monkeypatch.setattr(flask_pymongo, "MongoClient", mongomock.MongoClient)
+
+    from app import create_app
+    from extensions import mongo
+
+    app = create_app()
+    db = mongo.db
+    for name in ("users", "units", "questions", "answers"):
+        db[name].delete_many({})
+
+    units = [ObjectId(), ObjectId()]
+    db.units.insert_many([{"_id": u, "title": f"U{i}", "level": i} for i, u in enumerate(units)])
+    questions = [{"_id": ObjectId(), "unit_id": units[i % 2], "type": "OpenEntry", "body": "?",
+                  "exp": 10, "expectedAnswer": "1"} for i in range(4)]
+    db.questions.insert_many(questions)
+    users = [{"_id": ObjectId(), "DNI": str(1000 + i), "name": "N", "lastname": "L", "exp": 0}
+             for i in range(USERS)]
+    db.users.insert_many(users)
+    db.answers.insert_many([
+        {"user_id": u["_id"], "question_id": q["_id"], "body": "1", "correct": True}
+        for u in users for q in questions
+    ])
+
+    client = app.test_client()
+    client.units = units
+    return client
+
+
+def _ndjson(resp):
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines() if line]
+
+
+def test_report_covers_every_batch(client):
+    resp = client.get("/users/report?format=ndjson")
+    assert resp.status_code == 200
+    reports = _ndjson(resp)
+    assert len(reports) == USERS
+    assert all(len(r["questions_answered"]) == 4 for r in reports)
+
+
+def test_report_unit_filter_applies_to_every_batch(client):
+    resp = client.get(f"/users/report?format=ndjson&unit_id={client.units[0]}")
+    assert resp.status_code == 200
+    reports = _ndjson(resp)
+    assert len(reports) == USERS
+    assert all(len(r["questions_answered"]) == 2 for r in reports)
+    assert all(qa["question"]["unit_id"] == str(client.units[0])
+               for r in reports for qa in r["questions_answered"])
+
+
+def _csv(resp):
+    import csv
+    import io
+    text = resp.get_data(as_text=True).lstrip("﻿")
+    return list(csv.reader(io.StringIO(text)))
+
+
+def test_csv_report_covers_every_batch(client):
+    resp = client.get("/users/report?format=csv")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/csv"
+    header, *rows = _csv(resp)
+    assert header[:5] == ["user_id", "DNI", "name", "lastname", "exp"]
+    assert header[5:] == ["U0 resueltas", "U0 exp", "U1 resueltas", "U1 exp"]
+    assert len(rows) == USERS
+
+
+def test_csv_report_unit_filter(client):
+    resp = client.get(f"/users/report?format=csv&unit_id={client.units[1]}")
+    header, *rows = _csv(resp)
+    assert header[5:] == ["U1 resueltas", "U1 exp"]
+    assert all(len(row) == 7 for row in rows)
+
+
+def test_single_user_honours_format(client):
+    resp = client.get("/users/report?format=ndjson")
+    user_id = _ndjson(resp)[0]["user"]["id"]
+
+    resp = client.get(f"/users/report?user_id={user_id}&format=csv")
+    assert resp.mimetype == "text/csv"
+    header, *rows = _csv(resp)
+    assert [row[0] for row in rows] == [user_id]
+
+    resp = client.get(f"/users/report?user_id={user_id}&format=ndjson")
+    assert resp.mimetype == "application/x-ndjson"
+    assert [r["user"]["id"] for r in _ndjson(resp)] == [user_id]
+
+    resp = client.get(f"/users/report?user_id={user_id}")
+    assert resp.get_json()["user"]["id"] == user_id
@@ -0,0 +1,7 @@
+# Punto de entrada para producción:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# gunicorn.conf.py no precarga la app, así create_app() corre en cada worker
+# después del fork y ningún cliente de MongoDB se comparte entre procesos.
+from app import create_app
+
+app = create_app()